@@ -1,50 +1,206 @@
 # common/framing.py
-import struct, json, socket
+import asyncio, hashlib, os, struct, json, socket, threading
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 MAX_LEN = 65536
+_HDR = struct.Struct('!I')
+# Frames below this size are concatenated with their header; larger ones use
+# vectored I/O so the payload is not copied just to prepend 4 bytes.
+_COALESCE_LEN = 8192
+# Payload size for multi-frame transfers (archives); leaves headroom under MAX_LEN.
+CHUNK_LEN = 60000
+# Kernel socket buffer for connections that carry archives; set before
+# connect()/listen() so the TCP window can scale to it.
+BULK_SOCK_BUF = 1 << 20
+
+# orjson emits/accepts UTF-8 bytes directly, so no str encode/decode hop per message.
+if orjson is not None:
+    _dumps = orjson.dumps
+    _loads = orjson.loads
+else:
+    # json.dumps builds a fresh JSONEncoder on every call once ensure_ascii is
+    # overridden; keep one compact encoder around instead.
+    _encode = json.JSONEncoder(ensure_ascii=False, separators=(',', ':')).encode
+    # Bound decode skips json.loads' type checks and keyword dispatch per frame.
+    _decode = json.JSONDecoder().decode
+
+    def _dumps(obj) -> bytes:
+        return _encode(obj).encode('utf-8')
+
+    def _loads(data):
+        return _decode(str(data, 'utf-8'))
+
+# Per-thread receive buffer reused for every frame (sessions each run in their own thread).
+_rx = threading.local()
 
 def send_raw(sock: socket.socket, payload: bytes):
     if len(payload) > MAX_LEN:
         raise ValueError("payload too large")
-    hdr = struct.pack('!I', len(payload))
-    _sendall(sock, hdr)
-    _sendall(sock, payload)
+    hdr = _HDR.pack(len(payload))
+    if len(payload) < _COALESCE_LEN or not hasattr(sock, "sendmsg"):
+        _sendall(sock, hdr + payload)
+        return
+    sent = sock.sendmsg([hdr, payload])
+    if sent < len(hdr):
+        _sendall(sock, hdr[sent:])
+        sent = len(hdr)
+    if sent - len(hdr) < len(payload):
+        _sendall(sock, memoryview(payload)[sent - len(hdr):])
 
 def send_json(sock: socket.socket, obj: dict):
-    data = json.dumps(obj, ensure_ascii=False).encode('utf-8')
-    send_raw(sock, data)
+    send_raw(sock, _dumps(obj))
 
 def recv_raw(sock: socket.socket) -> bytes | None:
-    hdr = _recvn(sock, 4)
-    if not hdr:
+    view = _recv_frame(sock)
+    return None if view is None else bytes(view)
+
+def recv_json(sock: socket.socket) -> dict | None:
+    view = _recv_frame(sock)
+    if not view: return None
+    try:
+        return _loads(view)
+    except Exception:
         return None
-    (n,) = struct.unpack('!I', hdr)
-    if n <= 0 or n > MAX_LEN:
+
+def pack_json(obj: dict) -> bytes:
+    """Header + body of one frame, for writers that buffer (asyncio streams)."""
+    payload = _dumps(obj)
+    if len(payload) > MAX_LEN:
+        raise ValueError("payload too large")
+    return _HDR.pack(len(payload)) + payload
+
+async def read_json(reader: asyncio.StreamReader) -> dict | None:
+    """recv_json for an asyncio StreamReader; None on EOF or a bad frame."""
+    try:
+        (n,) = _HDR.unpack(await reader.readexactly(_HDR.size))
+        if n <= 0 or n > MAX_LEN: return None
+        body = await reader.readexactly(n)
+    except (asyncio.IncompleteReadError, ConnectionError):
+        return None
+    try:
+        return _loads(body)
+    except Exception:
         return None
-    body = _recvn(sock, n)
-    return body
 
-def recv_json(sock: socket.socket) -> dict | None:
-    body = recv_raw(sock)
-    if not body: return None
+def recv_json_file(rf) -> dict | None:
+    """recv_json for a buffered reader from sock.makefile('rb'); BufferedReader does the recv loop in C."""
+    hdr = rf.read(_HDR.size)
+    if len(hdr) < _HDR.size: return None
+    (n,) = _HDR.unpack(hdr)
+    if n <= 0 or n > MAX_LEN: return None
+    body = rf.read(n)
+    if len(body) < n: return None
     try:
-        return json.loads(body.decode('utf-8'))
+        return _loads(body)
     except Exception:
         return None
 
+def send_chunks(sock: socket.socket, f, op: str, chunk: int = CHUNK_LEN, sha256: str | None = None) -> int:
+    """Stream a binary file object as (JSON envelope, raw frame) pairs; returns bytes sent.
+
+    The final envelope carries the SHA-256 of the whole stream, hashed chunk by
+    chunk as it is read, so the receiver can verify without a second pass.
+    When the caller already knows the digest of a real file, the payloads go
+    out with sendfile() and never pass through user space.
+    """
+    if sha256 and hasattr(os, "sendfile") and hasattr(f, "fileno"):
+        return _sendfile_chunks(sock, f, op, chunk, sha256)
+    data = f.read(chunk)
+    if not data:
+        raise ValueError("empty stream")
+    digest = hashlib.sha256()
+    seq = total = 0
+    while data:
+        nxt = f.read(chunk)
+        digest.update(data)
+        env = {"op": op, "seq": seq, "final": not nxt}
+        if not nxt:
+            env["sha256"] = digest.hexdigest()
+        send_json(sock, env)
+        send_raw(sock, data)
+        total += len(data)
+        data = nxt
+        seq += 1
+    return total
+
+def _sendfile_chunks(sock: socket.socket, f, op: str, chunk: int, sha256: str) -> int:
+    start = f.tell()
+    end = os.fstat(f.fileno()).st_size
+    if end <= start:
+        raise ValueError("empty stream")
+    offset, seq = start, 0
+    while offset < end:
+        n = min(chunk, end - offset)
+        env = {"op": op, "seq": seq, "final": offset + n >= end}
+        if env["final"]:
+            env["sha256"] = sha256
+        # envelope frame + the payload frame's header in one send, then the payload from the page cache
+        _sendall(sock, pack_json(env) + _HDR.pack(n))
+        if sock.sendfile(f, offset, n) != n:
+            raise ConnectionError("short sendfile")
+        offset += n
+        seq += 1
+    return end - start
+
+def recv_chunks(sock: socket.socket, out, op: str, digest=None, limit: int | None = None) -> int | None:
+    """Receive a send_chunks stream into out; None on EOF or an out-of-sequence envelope.
+
+    Raises ValueError if the stream arrived complete but its SHA-256 does not
+    match the sender's; the connection is still frame-aligned in that case.
+    Pass a hashlib.sha256() as digest to keep the hash of what was received.
+    With ``limit``, stops at the first chunk that would go past it, without
+    writing that chunk, and returns a count above ``limit``. The rest of the
+    stream is left unread, so the caller should drop the connection.
+    """
+    if digest is None:
+        digest = hashlib.sha256()
+    seq = total = 0
+    while True:
+        env = recv_json(sock)
+        if not env or env.get("op") != op or env.get("seq") != seq:
+            return None
+        view = _recv_frame(sock)
+        if view is None:
+            return None
+        if limit is not None and total + len(view) > limit:
+            return total + len(view)
+        out.write(view)
+        digest.update(view)
+        total += len(view)
+        if env.get("final"):
+            expected = env.get("sha256")
+            if expected and expected != digest.hexdigest():
+                raise ValueError("sha256 mismatch")
+            return total
+        seq += 1
+
+def _recv_frame(sock: socket.socket) -> memoryview | None:
+    """Read one frame into the thread's buffer; the view is valid until the next receive."""
+    buf = getattr(_rx, "view", None)
+    if buf is None:
+        buf = _rx.view = memoryview(bytearray(MAX_LEN))
+    if not _recv_into(sock, buf[:_HDR.size]):
+        return None
+    (n,) = _HDR.unpack(buf[:_HDR.size])
+    if n <= 0 or n > MAX_LEN:
+        return None
+    view = buf[:n]
+    if not _recv_into(sock, view):
+        return None
+    return view
+
 def _sendall(sock: socket.socket, data: bytes):
-    view = memoryview(data)
-    while len(view):
-        n = sock.send(view)
-        if n <= 0: raise ConnectionError("send error")
-        view = view[n:]
-
-def _recvn(sock: socket.socket, n: int) -> bytes | None:
-    buf = bytearray(n)
-    view = memoryview(buf)
-    got = 0
+    # socket.sendall loops over partial sends in C; no per-iteration memoryview slices.
+    sock.sendall(data)
+
+def _recv_into(sock: socket.socket, view: memoryview) -> bool:
+    got, n = 0, len(view)
     while got < n:
         k = sock.recv_into(view[got:])
-        if k == 0: return None
+        if k == 0: return False
         got += k
-    return bytes(buf)
+    return True
@@ -0,0 +1,116 @@
+# common/journal.py
+"""Snapshot + append-only change log for the dict-of-sections JSON databases.
+
+The snapshot is the plain JSON file the servers always wrote (``{"section":
+{key: record}}``). Each change after it is one log line ``[section, key,
+record]`` (``record`` null = deleted), so persisting a mutation costs the size
+of the changed record, not of the whole DB. ``compact`` folds the log back
+into a fresh snapshot once it grows.
+"""
+import json
+import os
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+if orjson is not None:
+    _dumps = orjson.dumps
+    _loads = orjson.loads
+else:
+    _encode = json.JSONEncoder(ensure_ascii=False, separators=(',', ':')).encode
+
+    def _dumps(obj) -> bytes:
+        return _encode(obj).encode('utf-8')
+
+    def _loads(data):
+        return json.loads(data)
+
+
+class Journal:
+    def __init__(self, path: str, compact_after: int = 1000, compact_bytes: int = 4 << 20):
+        self.path = path
+        self.log_path = path + ".log"
+        # Compact on whichever comes first: a few large records can bloat the
+        # log long before the entry count does.
+        self.compact_after = compact_after
+        self.compact_bytes = compact_bytes
+        self.entries = 0
+        self.size = 0
+        self._log = None
+
+    def load(self, default: dict) -> dict:
+        """Read the snapshot (or ``default``) and replay the log on top of it."""
+        if os.path.exists(self.path):
+            with open(self.path, "rb") as f:
+                db = _loads(f.read())
+        else:
+            # The servers write a snapshot before their first append, so a log
+            # without one is left over from a deleted DB: replaying it would
+            # resurrect the records the reset removed.
+            try:
+                os.remove(self.log_path)
+            except FileNotFoundError:
+                pass
+            return default
+        try:
+            with open(self.log_path, "r+b") as f:
+                good = 0
+                for line in f:
+                    try:
+                        section, key, record = _loads(line)
+                    except (ValueError, TypeError):
+                        # Torn last line from a crash mid-append: cut it off so
+                        # the next append does not glue onto the fragment.
+                        f.truncate(good)
+                        break
+                    if record is None:
+                        db.setdefault(section, {}).pop(key, None)
+                    else:
+                        db.setdefault(section, {})[key] = record
+                    good += len(line)
+                    self.entries += 1
+                self.size = good
+        except FileNotFoundError:
+            pass
+        return db
+
+    def append(self, records: list):
+        """Append ``(section, key, record)`` changes with a single write."""
+        if not records:
+            return
+        if self._log is None:
+            self._log = open(self.log_path, "ab", buffering=0)
+        data = b"".join(_dumps(list(r)) + b"\n" for r in records)
+        self._log.write(data)
+        self.entries += len(records)
+        self.size += len(data)
+
+    def should_compact(self) -> bool:
+        return self.entries >= self.compact_after or self.size >= self.compact_bytes
+
+    def compact(self, db: dict):
+        """Write ``db`` as the new snapshot, then drop the log it supersedes."""
+        if orjson is not None:
+            data = orjson.dumps(db, option=orjson.OPT_INDENT_2)
+        else:
+            data = json.dumps(db, ensure_ascii=False, indent=2).encode("utf-8")
+        tmp = self.path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, self.path)
+        # Replaying a log over a snapshot that already contains it is harmless,
+        # so a crash between the replace and the truncate loses nothing.
+        if self._log is not None:
+            self._log.close()
+            self._log = None
+        with open(self.log_path, "wb"):
+            pass
+        self.entries = 0
+        self.size = 0
+
+    def close(self):
+        if self._log is not None:
+            self._log.close()
+            self._log = None
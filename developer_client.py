@@ -1,24 +1,22 @@
 #!/usr/bin/env python3
 """Menu-driven developer client for HW3 store server."""
 import argparse
-import base64
 import json
 import os
+import re
 import shutil
 import socket
 import tempfile
 
-from common.framing import recv_json, send_json
+from common.framing import BULK_SOCK_BUF, recv_json_file, send_chunks, send_json
+
+
+# \w 就是 str.isalnum() 加上底線；其他字元逐一換成 "-"，整段交給 C 層的 regex 一次掃完
+_NON_SLUG = re.compile(r"[^\w-]")
 
 
 def slugify(name: str) -> str:
-    out = []
-    for ch in name.lower():
-        if ch.isalnum() or ch in "-_":
-            out.append(ch)
-        else:
-            out.append("-")
-    slug = "".join(out).strip("-")
+    slug = _NON_SLUG.sub("-", name.lower()).strip("-")
     return slug or "game"
 
 
@@ -59,16 +57,27 @@ class StoreConn:
         self.host = host
         self.port = port
         self.s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        # 上傳 zip 走這條連線，放大送出緩衝
+        self.s.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, BULK_SOCK_BUF)
         self.s.connect((host, port))
-        recv_json(self.s)  # hello
+        # 回應一律經由緩衝讀取，不可再直接對 socket recv
+        self.rf = self.s.makefile("rb", buffering=64 * 1024)
+        recv_json_file(self.rf)  # hello
 
     def request(self, payload: dict) -> dict:
         send_json(self.s, payload)
-        resp = recv_json(self.s)
+        resp = recv_json_file(self.rf)
+        return resp or {"ok": False, "code": "NO_RESPONSE"}
+
+    def stream(self, f, op: str) -> dict:
+        """Send a file as chunk frames, then read the single reply."""
+        send_chunks(self.s, f, op)
+        resp = recv_json_file(self.rf)
         return resp or {"ok": False, "code": "NO_RESPONSE"}
 
     def close(self):
         try:
+            self.rf.close()
             self.s.close()
         except OSError:
             pass
@@ -170,18 +179,20 @@ def upload_game(conn: StoreConn, authed: bool, preset_game: dict | None = None):
 
     with tempfile.TemporaryDirectory() as tmp:
         zip_path = shutil.make_archive(os.path.join(tmp, "bundle"), "zip", path)
-        with open(zip_path, "rb") as f:
-            b64 = base64.b64encode(f.read()).decode("utf-8")
-    resp = conn.request({
-        "op": "dev_upload",
-        "game_id": gid,
-        "name": name,
-        "version": version,
-        "description": desc,
-        "game_type": game_type,
-        "max_players": max_players,
-        "archive_b64": b64,
-    })
+        resp = conn.request({
+            "op": "dev_upload",
+            "game_id": gid,
+            "name": name,
+            "version": version,
+            "description": desc,
+            "game_type": game_type,
+            "max_players": max_players,
+            "archive_size": os.path.getsize(zip_path),
+        })
+        # server 同意後才從磁碟逐塊送出 zip，記憶體只留一塊
+        if resp.get("code") == "SEND_ARCHIVE":
+            with open(zip_path, "rb") as f:
+                resp = conn.stream(f, "dev_upload_chunk")
     if resp.get("ok"):
         print(f"✅ 上傳完成：{resp.get('game_id')} 版本 {resp.get('version')}")
     else:
@@ -196,6 +207,9 @@ def upload_game(conn: StoreConn, authed: bool, preset_game: dict | None = None):
             "SESSION_EXPIRED": "登入已失效，請重新登入。",
             "NO_ARCHIVE": "未附上遊戲檔案。",
             "UNPACK_FAIL": "壓縮檔無法解壓縮。",
+            "BAD_ARCHIVE": "壓縮檔傳輸不完整。",
+            "BAD_PATH": "壓縮檔內含不安全的路徑（絕對路徑或 ..）。",
+            "ARCHIVE_TOO_LARGE": "壓縮檔或解壓後檔案過大（上限 100 MB），或壓縮比異常。",
             "BAD_FIELD": f"欄位錯誤: {resp.get('field')}",
         }
         print(f"❌ 上傳失敗 [{code}] {friendly.get(code,'')}")
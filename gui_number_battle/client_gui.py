@@ -15,17 +15,31 @@ def send_json(sock: socket.socket, obj: dict):
     sock.sendall(hdr + data)
 
 
+# MSG_WAITALL 讓核心一次收滿；只有被訊號打斷或連線關閉時才會回到迴圈補收
+_WAITALL = getattr(socket, "MSG_WAITALL", 0)
+
+
+def _recvn(sock: socket.socket, n: int):
+    # 預先配置好整個 frame，recv_into 直接寫入，避免 bytes 反覆串接
+    buf = bytearray(n)
+    mv = memoryview(buf)
+    got = 0
+    while got < n:
+        k = sock.recv_into(mv[got:], n - got, _WAITALL)
+        if not k:
+            return None
+        got += k
+    return buf
+
+
 def recv_json(sock: socket.socket) -> dict | None:
-    hdr = sock.recv(4)
-    if not hdr:
+    hdr = _recvn(sock, 4)
+    if hdr is None:
         return None
     n = int.from_bytes(hdr, "big")
-    body = b""
-    while len(body) < n:
-        chunk = sock.recv(n - len(body))
-        if not chunk:
-            return None
-        body += chunk
+    body = _recvn(sock, n)
+    if body is None:
+        return None
     try:
         return json.loads(body.decode("utf-8"))
     except Exception:
@@ -38,6 +52,7 @@ class GuiClient:
         self.port = port
         self.user = user
         self.sock = socket.create_connection((host, port))
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
         send_json(self.sock, {"op": "hello", "user": user})
 
         self.in_q: queue.Queue[dict] = queue.Queue()
@@ -1,35 +1,107 @@
 #!/usr/bin/env python3
 """Menu-driven lobby player client."""
 import argparse
-import base64
+import io
 import json
 import os
-import shutil
+import selectors
 import socket
 import subprocess
 import sys
-import tempfile
+import zipfile
 from typing import Dict, Optional
 import time
-import socket
 import importlib.util
+import copy
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from common.framing import BULK_SOCK_BUF, recv_chunks, recv_json, send_json
+
 
-from common.framing import recv_json, send_json
+# 大廳連線的讀取逾時；須大於 wait_room_update 的長輪詢秒數
+LOBBY_TIMEOUT = 15.0
+# 對方掛掉時由 keepalive 約 60 秒內偵測到，而不是永遠卡在 recv
+_KEEPALIVE = [(getattr(socket, name), val)
+              for name, val in (("TCP_KEEPIDLE", 30), ("TCP_KEEPINTVL", 10), ("TCP_KEEPCNT", 3))
+              if hasattr(socket, name)]
+# 斷線重連後可以安全重送的唯讀請求
+_RETRY_OPS = {"list_rooms", "list_players", "bulk_status", "room_info", "wait_room_update"}
 
 
 class LobbyConn:
     def __init__(self, host: str, port: int):
         self.host = host
         self.port = port
-        self.s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.s.connect((host, port))
-        recv_json(self.s)  # hello
+        # 登入成功的請求，重連後重送以恢復 session
+        self.login: Optional[dict] = None
+        self._connect()
+
+    def _connect(self):
+        s = socket.create_connection((self.host, self.port), timeout=LOBBY_TIMEOUT)
+        # 一問一答的小封包，關掉 Nagle 避免每次來回多等 ACK
+        s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        for opt, val in _KEEPALIVE:
+            s.setsockopt(socket.IPPROTO_TCP, opt, val)
+        self.s = s
+        recv_json(s)  # hello
+        # 已送出但還沒讀回應的長輪詢請求數（被鍵盤輸入打斷時留下）
+        self.pending = 0
+
+    def _reconnect(self) -> bool:
+        self.close()
+        try:
+            self._connect()
+            if self.login:
+                send_json(self.s, self.login)
+                resp = recv_json(self.s)
+                return bool(resp and resp.get("ok"))
+            return True
+        except OSError:
+            return False
 
     def request(self, payload: dict) -> dict:
+        try:
+            self.send(payload)
+            resp = self._recv()
+        except OSError:
+            resp = None
+        if resp is None and self._reconnect() and payload.get("op") in _RETRY_OPS:
+            try:
+                self.send(payload)
+                resp = self._recv()
+            except OSError:
+                resp = None
+        if resp is None:
+            return {"ok": False, "code": "NO_RESPONSE"}
+        op = payload.get("op")
+        if op == "login" and resp.get("ok"):
+            self.login = payload
+        elif op == "logout":
+            self.login = None
+        return resp
+
+    def send(self, payload: dict):
         send_json(self.s, payload)
-        resp = recv_json(self.s)
+        self.pending += 1
+
+    def recv(self) -> dict:
+        try:
+            resp = self._recv()
+        except OSError:
+            resp = None
         return resp or {"ok": False, "code": "NO_RESPONSE"}
 
+    def _recv(self) -> Optional[dict]:
+        # 先丟掉被打斷的 wait_room_update 回應，維持一問一答的順序
+        while self.pending > 1:
+            self.pending -= 1
+            recv_json(self.s)
+        self.pending = 0
+        return recv_json(self.s)
+
     def close(self):
         try:
             self.s.close()
@@ -37,56 +109,242 @@ class LobbyConn:
             pass
 
 
+# pipeline 每批最多同時在途的請求數
+PIPELINE_DEPTH = 16
+# 預取的遊戲詳細資料只在這段時間內有效（秒）
+PREFETCH_TTL = 30.0
+
+
 class StoreAPI:
     def __init__(self, host: str, port: int):
         self.host = host
         self.port = port
-
-    def call(self, payload: dict) -> dict:
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        self.s: Optional[socket.socket] = None
+        # 背景預取與主執行緒共用同一條連線，一問一答需整段互斥
+        self.lock = threading.RLock()
+        # 預取的 game_detail：gid -> (抓取時間, game)，取用一次即丟棄，避免顯示過舊的評價
+        self._details: Dict[str, tuple] = {}
+
+    def _connect(self):
+        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            # 下載的 zip 走這條連線，放大接收緩衝讓每次 recv 拿到更多資料
+            s.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, BULK_SOCK_BUF)
             s.connect((self.host, self.port))
+            s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
             # consume store server hello
-            _ = recv_json(s)
-            send_json(s, payload)
-            resp = recv_json(s)
-            return resp or {"ok": False, "code": "NO_RESPONSE"}
+            recv_json(s)
+        except OSError:
+            s.close()
+            raise
+        self.s = s
+
+    def call(self, payload: dict) -> dict:
+        with self.lock:
+            return self._call(payload)
+
+    def _call(self, payload: dict) -> dict:
+        return self._pipeline([payload])[0]
+
+    def pipeline(self, payloads: list) -> list:
+        """一次送出多個互不相依的請求再依序讀回應，N 個請求只花一趟來回。"""
+        out = []
+        with self.lock:
+            # 分批送，避免雙方緩衝都塞滿時互相等待
+            for i in range(0, len(payloads), PIPELINE_DEPTH):
+                out.extend(self._pipeline(payloads[i:i + PIPELINE_DEPTH]))
+        return out
+
+    def _pipeline(self, batch: list) -> list:
+        # 沿用同一條連線；若閒置時已被 server 關閉（一個回應都沒拿到），重連一次再送
+        got = []
+        for _ in range(2):
+            fresh = self.s is None
+            try:
+                if fresh:
+                    self._connect()
+                for payload in batch:
+                    send_json(self.s, payload)
+                for _ in batch:
+                    resp = recv_json(self.s)
+                    if resp is None:
+                        break
+                    got.append(resp)
+            except OSError:
+                pass
+            if len(got) == len(batch):
+                return got
+            self.close()
+            if got or fresh:
+                break
+        return got + [{"ok": False, "code": "NO_RESPONSE"} for _ in batch[len(got):]]
+
+    def close(self):
+        if self.s is not None:
+            try:
+                self.s.close()
+            except OSError:
+                pass
+            self.s = None
 
     def list_games(self):
         return self.call({"op": "list_games"})
 
     def game_detail(self, gid: str):
+        hit = self._details.pop(gid, None)
+        if hit is not None and time.monotonic() - hit[0] < PREFETCH_TTL:
+            return {"ok": True, "code": "GAME", "game": hit[1]}
         return self.call({"op": "game_detail", "game_id": gid})
 
+    def prefetch_details(self, gids: list):
+        """背景抓取多款遊戲的詳細資料，玩家看選單時就把來回時間藏掉。"""
+        self._details.clear()
+
+        def work():
+            # 回應與寫入快取在同一段鎖內完成，record_rating 不會被晚到的舊資料蓋回去
+            with self.lock:
+                resp = self._call({"op": "game_details_batch", "game_ids": gids})
+                if resp.get("ok"):
+                    now = time.monotonic()
+                    self._details.update((gid, (now, game)) for gid, game in resp.get("games", {}).items())
+        threading.Thread(target=work, daemon=True).start()
+
     def download_game(self, gid: str, player: str, version: Optional[str] = None):
+        """成功時 resp["archive"] 為原始 zip bytes（header 之後以 chunk frame 傳送）。"""
         payload = {"op": "download_game", "game_id": gid, "player": player}
         if version:
             payload["version"] = version
-        return self.call(payload)
+        with self.lock:
+            return self._download_game(payload)
+
+    def _download_game(self, payload: dict):
+        resp = self._call(payload)
+        size = resp.get("archive_size")
+        if not resp.get("ok"):
+            return resp
+        if size is None:
+            return {"ok": False, "code": "NO_ARCHIVE"}
+        buf = io.BytesIO()
+        try:
+            got = recv_chunks(self.s, buf, "download_chunk", limit=size)
+        except ValueError:
+            return {"ok": False, "code": "CHECKSUM_MISMATCH"}
+        except OSError:
+            got = None
+        if got != size:
+            self.close()
+            return {"ok": False, "code": "DOWNLOAD_INCOMPLETE"}
+        resp["archive"] = buf.getbuffer()
+        return resp
 
     def record_rating(self, gid: str, player: str, score: int, comment: str):
-        return self.call({"op": "record_rating", "game_id": gid, "player": player, "score": score, "comment": comment})
+        with self.lock:
+            self._details.pop(gid, None)
+            return self._call({"op": "record_rating", "game_id": gid, "player": player, "score": score, "comment": comment})
+
+
+# base_dir -> ((mtime_ns, size), manifest)；檔案沒變就直接回傳記憶體中的內容。
+# stamp 為 None 表示背景還有尚未寫入的版本，此時以記憶體為準。
+_MANIFEST_CACHE: Dict[str, tuple] = {}
+_MANIFEST_PENDING: Dict[str, int] = {}
+_MANIFEST_LOCK = threading.Lock()
+_MANIFEST_QUEUE: "queue.Queue[tuple]" = queue.Queue()
+_manifest_writer: Optional[threading.Thread] = None
+
+
+def _manifest_stamp(path: str):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
 
 
 def load_manifest(base_dir: str) -> Dict:
     path = os.path.join(base_dir, "manifest.json")
-    if os.path.exists(path):
-        with open(path, "r", encoding="utf-8") as f:
-            return json.load(f)
-    return {"downloads": {}}
+    with _MANIFEST_LOCK:
+        cached = _MANIFEST_CACHE.get(base_dir)
+        if cached and cached[0] is None:
+            return cached[1]
+    stamp = _manifest_stamp(path)
+    if stamp is None:
+        return {"downloads": {}}
+    if cached and cached[0] == stamp:
+        return cached[1]
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    with _MANIFEST_LOCK:
+        _MANIFEST_CACHE[base_dir] = (stamp, data)
+    return data
+
+
+def _write_manifest(base_dir: str, data: Dict) -> str:
+    os.makedirs(base_dir, exist_ok=True)
+    path = os.path.join(base_dir, "manifest.json")
+    tmp = path + ".tmp"
+    # 整份先編成 bytes，一次 os.write 寫入暫存檔再 os.replace，不會留下寫一半的 manifest
+    payload = json.dumps(data, ensure_ascii=False, indent=2).encode("utf-8")
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        view = memoryview(payload)
+        while view:
+            view = view[os.write(fd, view):]
+    finally:
+        os.close(fd)
+    os.replace(tmp, path)
+    return path
+
+
+def _manifest_worker():
+    while True:
+        base_dir, live, snapshot = _MANIFEST_QUEUE.get()
+        try:
+            path = _write_manifest(base_dir, snapshot)
+            stamp = _manifest_stamp(path)
+        except OSError as exc:
+            print("寫入 manifest 失敗", exc)
+            stamp = None
+        with _MANIFEST_LOCK:
+            _MANIFEST_PENDING[base_dir] -= 1
+            cached = _MANIFEST_CACHE.get(base_dir)
+            # 最後一筆寫完才恢復用 mtime 驗證快取
+            if stamp and not _MANIFEST_PENDING[base_dir] and cached and cached[1] is live:
+                _MANIFEST_CACHE[base_dir] = (stamp, live)
+        _MANIFEST_QUEUE.task_done()
 
 
 def save_manifest(base_dir: str, data: Dict):
-    os.makedirs(base_dir, exist_ok=True)
-    path = os.path.join(base_dir, "manifest.json")
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+    """更新記憶體快取後交給背景執行緒寫檔（tmp + os.replace），不阻塞選單。"""
+    global _manifest_writer
+    with _MANIFEST_LOCK:
+        _MANIFEST_CACHE[base_dir] = (None, data)
+        _MANIFEST_PENDING[base_dir] = _MANIFEST_PENDING.get(base_dir, 0) + 1
+        if _manifest_writer is None:
+            _manifest_writer = threading.Thread(target=_manifest_worker, daemon=True)
+            _manifest_writer.start()
+    _MANIFEST_QUEUE.put((base_dir, data, copy.deepcopy(data)))
+
+
+def flush_manifests():
+    """等待所有排隊中的 manifest 寫入完成。"""
+    _MANIFEST_QUEUE.join()
+
+
+# (downloads_root, gid) -> (到期時間, version, path)；遊戲結束回到房間時連 manifest 的 stat 都省掉
+_RECENT: Dict[tuple, tuple] = {}
+RECENT_TTL = 5.0
 
 
 def ensure_download(api: StoreAPI, lobby: LobbyConn, user: str, downloads_root: str, gid: str, target_version: Optional[str]) -> Optional[str]:
     """Return local path, downloading if needed."""
+    key = (downloads_root, gid)
+    recent = _RECENT.get(key)
+    if recent and recent[0] > time.monotonic() and target_version in (None, recent[1]):
+        return recent[2]
     manifest = load_manifest(downloads_root)
     current = manifest["downloads"].get(gid, {})
     if current and (target_version is None or current.get("version") == target_version):
+        _RECENT[key] = (time.monotonic() + RECENT_TTL, current.get("version"), current.get("path"))
         return current.get("path")
 
     print(f"⬇️  正在下載 {gid} ...")
@@ -95,37 +353,39 @@ def ensure_download(api: StoreAPI, lobby: LobbyConn, user: str, downloads_root:
         print("下載失敗", resp)
         return None
     version = resp.get("version")
-    data_b64 = resp.get("archive_b64", "")
-    try:
-        blob = base64.b64decode(data_b64.encode("utf-8"))
-    except Exception as exc:
-        print("解碼失敗", exc)
-        return None
+    blob = resp.pop("archive")
 
     game_dir = os.path.join(downloads_root, gid, version)
     os.makedirs(game_dir, exist_ok=True)
-    zip_path = os.path.join(downloads_root, gid, f"{version}.zip")
-    with open(zip_path, "wb") as f:
-        f.write(blob)
+    # 直接從記憶體解壓，不再先寫一份 .zip 到磁碟再讀回來
     try:
-        shutil.unpack_archive(zip_path, game_dir)
+        with zipfile.ZipFile(io.BytesIO(blob)) as zf:
+            zf.extractall(game_dir)
     except Exception as exc:
         print("解壓縮失敗", exc)
         return None
+    finally:
+        del blob
 
     manifest["downloads"][gid] = {"version": version, "path": game_dir}
     save_manifest(downloads_root, manifest)
+    _RECENT[key] = (time.monotonic() + RECENT_TTL, version, game_dir)
     lobby.request({"op": "record_download", "game_id": gid, "version": version})
     print(f"✅ 下載完成 {gid} 版本 {version}")
     return game_dir
 
 
-def port_alive(host: str, port: int, timeout: float = 0.25) -> bool:
-    try:
-        with socket.create_connection((host, port), timeout=timeout):
-            return True
-    except OSError:
-        return False
+def menu_index(sel: str, n: int) -> Optional[int]:
+    """把 1-based 的選單輸入轉成 index；非數字或超出範圍回傳 None。"""
+    sel = sel.strip()
+    if not sel.isdigit():
+        return None
+    i = int(sel) - 1
+    return i if 0 <= i < n else None
+
+
+# 選單顯示時預取前幾款遊戲的詳細資料
+PREFETCH_DETAILS = 5
 
 
 def choose_game(api: StoreAPI) -> Optional[dict]:
@@ -139,13 +399,10 @@ def choose_game(api: StoreAPI) -> Optional[dict]:
         return None
     for idx, g in enumerate(games, 1):
         print(f"{idx}. {g['name']} ({g['id']}) v{g.get('latestVersion')} ⭐ {g.get('ratingAvg')} ({g.get('ratingCount')})")
-    sel = input("選擇遊戲編號: ").strip()
-    try:
-        i = int(sel) - 1
-        if 0 <= i < len(games):
-            return games[i]
-    except ValueError:
-        pass
+    api.prefetch_details([g["id"] for g in games[:PREFETCH_DETAILS]])
+    i = menu_index(input("選擇遊戲編號: "), len(games))
+    if i is not None:
+        return games[i]
     print("輸入錯誤")
     return None
 
@@ -163,12 +420,23 @@ def show_game_detail(api: StoreAPI):
     print("版本:", game.get("latestVersion"))
     print("人數:", game.get("maxPlayers"))
     print("簡介:", game.get("description"))
-    print("評價:", f"{game.get('ratingAvg',0)} / 5, {len(game.get('ratings',[]))} 則")
+    print("評價:", f"{game.get('ratingAvg',0)} / 5, {game.get('ratingCount', len(game.get('ratings', [])))} 則")
     for r in game.get("ratings", [])[:5]:
         print(f"- {r.get('user')}: {r.get('score')}⭐ {r.get('comment')}")
 
 
-def launch_client(gid: str, game_dir: str, server_host: str, server_port: int, user: str) -> tuple[bool, bool]:
+HEARTBEAT_SEC = 5.0
+# 遊戲客戶端的環境變數在啟動時擷取一次，每次啟動只覆寫 PYTHONPATH
+_BASE_ENV = dict(os.environ)
+_BASE_PYTHONPATH = _BASE_ENV.get("PYTHONPATH", "")
+# 已確認可 import 的模組；重複啟動遊戲時不必再掃 sys.path。
+# 只快取找得到的結果，使用者中途安裝缺少的模組後仍能重新檢查。
+_SPEC_FOUND: set = set()
+# 房間等待畫面的長輪詢秒數；房間一有變動伺服器就會提早回應
+ROOM_WAIT_SEC = 10.0
+
+
+def launch_client(gid: str, game_dir: str, server_host: str, server_port: int, user: str, heartbeat=None) -> tuple[bool, bool]:
     cfg_path = os.path.join(game_dir, "game_config.json")
     client_entry = "client.py"
     game_type = "cli"
@@ -184,7 +452,7 @@ def launch_client(gid: str, game_dir: str, server_host: str, server_port: int, u
             pass
     # 必要模組檢查
     for mod in requires:
-        if importlib.util.find_spec(mod) is None:
+        if mod not in _SPEC_FOUND and importlib.util.find_spec(mod) is None:
             msg = f"⚠️ 缺少必要模組 {mod}，請先安裝後再啟動"
             if mod == "tkinter":
                 msg += "（例如 Ubuntu 可執行: sudo apt-get install python3-tk）"
@@ -192,18 +460,63 @@ def launch_client(gid: str, game_dir: str, server_host: str, server_port: int, u
                 msg += "（例如: pip install pygame 或 apt-get install python3-pygame）"
             print(msg)
             return False, True
+        _SPEC_FOUND.add(mod)
     cmd = [sys.executable, client_entry, "--host", server_host, "--port", str(server_port), "--user", user]
-    env = os.environ.copy()
-    env["PYTHONPATH"] = game_dir + os.pathsep + env.get("PYTHONPATH", "")
+    env = {**_BASE_ENV, "PYTHONPATH": game_dir + os.pathsep + _BASE_PYTHONPATH}
     print(f"▶️ 啟動遊戲客戶端 {cmd}")
     # Inherit stdio so玩家可以看到提示與互動；僅在非零退出時給出簡短提示。
-    res = subprocess.run(cmd, cwd=game_dir, env=env)
-    if res.returncode != 0:
-        print(f"遊戲啟動失敗：程式退出碼 {res.returncode}")
+    proc = subprocess.Popen(cmd, cwd=game_dir, env=env)
+    # 等待遊戲結束期間定期呼叫 heartbeat，大廳連線與房間狀態不會停在開局前
+    while True:
+        try:
+            returncode = proc.wait(timeout=HEARTBEAT_SEC)
+            break
+        except subprocess.TimeoutExpired:
+            if heartbeat:
+                try:
+                    heartbeat()
+                except OSError:
+                    pass
+        except BaseException:
+            proc.kill()
+            proc.wait()
+            raise
+    if returncode != 0:
+        print(f"遊戲啟動失敗：程式退出碼 {returncode}")
         return False, False
     return True, False
 
 
+def wait_choice(lobby: LobbyConn, room: dict, prompt: str) -> Optional[str]:
+    """顯示選單並同時等待鍵盤輸入與房間變動；房間有變動時回傳 None。"""
+    print(prompt, end="", flush=True)
+    sel = selectors.DefaultSelector()
+    try:
+        sel.register(sys.stdin, selectors.EVENT_READ)
+    except (ValueError, OSError):
+        # stdin 不能 select（例如 Windows console），退回單純 input()
+        sel.close()
+        return input()
+    sel.register(lobby.s, selectors.EVENT_READ)
+    try:
+        while True:
+            lobby.send({"op": "wait_room_update", "room": room["id"], "known": room, "timeout": ROOM_WAIT_SEC})
+            while True:
+                events = sel.select()
+                if any(key.fileobj is sys.stdin for key, _ in events):
+                    line = sys.stdin.readline()
+                    if not line:
+                        raise EOFError
+                    return line
+                resp = lobby.recv()
+                if not resp.get("ok") or resp.get("changed"):
+                    print()
+                    return None
+                break  # 逾時且無變化：重新送出長輪詢
+    finally:
+        sel.close()
+
+
 def play_flow(api: StoreAPI, lobby: LobbyConn, user: str, downloads_root: str):
     # list rooms
     resp = lobby.request({"op": "list_rooms"})
@@ -243,6 +556,9 @@ def play_flow(api: StoreAPI, lobby: LobbyConn, user: str, downloads_root: str):
     if not game_dir:
         return
 
+    def heartbeat():
+        lobby.request({"op": "room_info", "room": room["id"]})
+
     # 進入房間狀態輪詢
     fail_count = 0
     while True:
@@ -256,11 +572,11 @@ def play_flow(api: StoreAPI, lobby: LobbyConn, user: str, downloads_root: str):
         print(f"\n房間 {room['id']} 狀態={room.get('status')} 成員={members}")
 
         # 若已啟動遊戲，直接連線
-        # 注意：避免事先用 port_alive 探測，否則會佔用 game server 的連線名額，導致伺服器提早關閉。
+        # 以大廳回報的 status == "playing" 為準，不另外探測 port：多連一次會佔用 game server 的連線名額，導致伺服器提早關閉。
         if room.get("status") == "playing" and room.get("server"):
             server = room["server"]
             if server.get("port"):
-                ok, fatal = launch_client(room["game_id"], game_dir, server.get("host"), server.get("port"), user)
+                ok, fatal = launch_client(room["game_id"], game_dir, server.get("host"), server.get("port"), user, heartbeat)
                 if not ok:
                     fail_count += 1
                     if fatal or fail_count >= 2:
@@ -282,19 +598,22 @@ def play_flow(api: StoreAPI, lobby: LobbyConn, user: str, downloads_root: str):
         # 主人選項
         if is_host:
             if len(members) < 2:
-                choice = input("等待其他玩家加入。1)刷新 2)離開房間 [1]: ").strip() or "1"
-                if choice == "2":
+                choice = wait_choice(lobby, room, "等待其他玩家加入。1)刷新 2)離開房間 [1]: ")
+                if choice is not None and choice.strip() == "2":
                     lobby.request({"op": "leave_room", "room": room["id"]})
                     print("已離開房間")
                     return
                 continue
-            choice = input("已有人加入，是否啟動？ 1)啟動 2)刷新 3)離開房間 [1]: ").strip() or "1"
+            choice = wait_choice(lobby, room, "已有人加入，是否啟動？ 1)啟動 2)刷新 3)離開房間 [1]: ")
+            if choice is None:
+                continue
+            choice = choice.strip() or "1"
             if choice == "1":
                 resp = lobby.request({"op": "start_room", "room": room["id"]})
                 if resp.get("ok"):
                     server = resp.get("server", {})
                     if server.get("port"):
-                        ok, fatal = launch_client(room["game_id"], game_dir, server.get("host"), server.get("port"), user)
+                        ok, fatal = launch_client(room["game_id"], game_dir, server.get("host"), server.get("port"), user, heartbeat)
                         if not ok:
                             fail_count += 1
                             if fatal or fail_count >= 2:
@@ -322,11 +641,11 @@ def play_flow(api: StoreAPI, lobby: LobbyConn, user: str, downloads_root: str):
                 print("已離開房間")
                 return
             # choice == 2: refresh
-            time.sleep(1); continue
+            continue
 
         # 非主人：等待或退出
-        choice = input("房主尚未啟動。1)刷新 2)離開房間 [1]: ").strip() or "1"
-        if choice == "2":
+        choice = wait_choice(lobby, room, "房主尚未啟動。1)刷新 2)離開房間 [1]: ")
+        if choice is not None and choice.strip() == "2":
             lobby.request({"op": "leave_room", "room": room["id"]})
             print("已離開房間")
             return
@@ -340,34 +659,35 @@ def rating_flow(api: StoreAPI, user: str, downloads_root: str):
     if not downloads:
         print("尚未下載任何遊戲，無法評分")
         return
-    gids = list(downloads.keys())
-    for idx, gid in enumerate(gids, 1):
-        print(f"{idx}. {gid} (版本 {downloads[gid]['version']})")
-    sel = input("選擇要評分的遊戲: ").strip()
-    try:
-        i = int(sel) - 1
-        if not (0 <= i < len(gids)):
-            raise ValueError()
-    except ValueError:
+    entries = list(downloads.items())
+    for idx, (gid, meta) in enumerate(entries, 1):
+        print(f"{idx}. {gid} (版本 {meta['version']})")
+    i = menu_index(input("選擇要評分的遊戲: "), len(entries))
+    if i is None:
+        print("輸入錯誤")
+        return
+    gid = entries[i][0]
+    score = input("分數 1-5: ").strip() or "5"
+    if not score.isdigit():
         print("輸入錯誤")
         return
-    gid = gids[i]
-    score = int(input("分數 1-5: ").strip() or "5")
+    score = int(score)
     comment = input("留言 (可空白): ").strip()
     resp = api.record_rating(gid, user, score, comment)
     print(resp)
 
 
 def show_status(api: StoreAPI, lobby: LobbyConn):
-    presp = lobby.request({"op": "list_players"})
-    rresp = lobby.request({"op": "list_rooms"})
-    gresp = api.list_games()
+    # 商城查詢在另一條連線上，與大廳的 bulk_status 同時進行
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        games_fut = pool.submit(api.list_games)
+        sresp = lobby.request({"op": "bulk_status"})
+        gresp = games_fut.result()
     print("\n=== 大廳狀態 ===")
-    if presp.get("ok"):
-        online = [u for u in presp.get("players", []) if u.get("online")]
+    if sresp.get("ok"):
+        online = [u for u in sresp.get("players", []) if u.get("online")]
         print("線上玩家:", [u.get("user") for u in online])
-    if rresp.get("ok"):
-        rooms = rresp.get("rooms", [])
+        rooms = sresp.get("rooms", [])
         print("公開房間:")
         for r in rooms:
             print(f"  {r['id']} [{r.get('status')}] {r.get('members')}")
@@ -375,30 +695,39 @@ def show_status(api: StoreAPI, lobby: LobbyConn):
         print("上架遊戲:", [g.get("id") for g in gresp.get("games", [])])
 
 
+AUTH_MENU = "\n=== 玩家登入 ===\n1. 註冊\n2. 登入\n0. 離開\n"
+AUTH_OPS = {"1": "register", "2": "login"}
+MAIN_MENU = (
+    "\n=== 玩家主選單 ===\n"
+    "1. 大廳狀態\n"
+    "2. 商城瀏覽/詳細資訊\n"
+    "3. 下載或更新遊戲\n"
+    "4. 建立/加入房間並啟動遊戲\n"
+    "5. 評分與評論\n"
+    "0. 登出並離開\n"
+)
+
+
 def auth_flow(lobby: LobbyConn) -> Optional[str]:
     while True:
-        print("\n=== 玩家登入 ===")
-        print("1. 註冊")
-        print("2. 登入")
-        print("0. 離開")
+        sys.stdout.write(AUTH_MENU)
         ch = input("選擇: ").strip()
-        if ch == "1":
-            u = input("帳號: ").strip()
-            p = input("密碼: ").strip()
-            resp = lobby.request({"op": "register", "user": u, "password": p})
-            print(resp)
-        elif ch == "2":
-            u = input("帳號: ").strip()
-            p = input("密碼: ").strip()
-            resp = lobby.request({"op": "login", "user": u, "password": p})
-            if resp.get("ok"):
-                print("✅ 登入成功")
-                return u
-            print("❌ 登入失敗")
-        elif ch == "0":
+        if ch == "0":
             return None
-        else:
+        op = AUTH_OPS.get(ch)
+        if op is None:
             print("請輸入 0-2")
+            continue
+        u = input("帳號: ").strip()
+        p = input("密碼: ").strip()
+        resp = lobby.request({"op": op, "user": u, "password": p})
+        if op == "register":
+            print(resp)
+        elif resp.get("ok"):
+            print("✅ 登入成功")
+            return u
+        else:
+            print("❌ 登入失敗")
 
 
 def main():
@@ -415,32 +744,28 @@ def main():
     if not user:
         return
     downloads_root = os.path.join(os.path.dirname(__file__), "downloads", user)
+
+    def download():
+        g = choose_game(store)
+        if g:
+            ensure_download(store, lobby, user, downloads_root, g["id"], g.get("latestVersion"))
+
+    handlers = {
+        "1": lambda: show_status(store, lobby),
+        "2": lambda: show_game_detail(store),
+        "3": download,
+        "4": lambda: play_flow(store, lobby, user, downloads_root),
+        "5": lambda: rating_flow(store, user, downloads_root),
+    }
     while True:
-        print("\n=== 玩家主選單 ===")
-        print("1. 大廳狀態")
-        print("2. 商城瀏覽/詳細資訊")
-        print("3. 下載或更新遊戲")
-        print("4. 建立/加入房間並啟動遊戲")
-        print("5. 評分與評論")
-        print("0. 登出並離開")
+        sys.stdout.write(MAIN_MENU)
         ch = input("選擇: ").strip()
-        if ch == "1":
-            show_status(store, lobby)
-        elif ch == "2":
-            show_game_detail(store)
-        elif ch == "3":
-            g = choose_game(store)
-            if g:
-                ensure_download(store, lobby, user, downloads_root, g["id"], g.get("latestVersion"))
-        elif ch == "4":
-            play_flow(store, lobby, user, downloads_root)
-        elif ch == "5":
-            rating_flow(store, user, downloads_root)
-        elif ch == "0":
+        if ch == "0":
             lobby.request({"op": "logout"})
             break
-        else:
-            print("請輸入 0-5")
+        handlers.get(ch, lambda: print("請輸入 0-5"))()
+    flush_manifests()
+    store.close()
     lobby.close()
 
 
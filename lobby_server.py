@@ -8,8 +8,14 @@ Responsibilities:
 - Track simple download manifest per player to check versions before starting.
 """
 import argparse
-import json
+import asyncio
+import concurrent.futures
+import copy
+import functools
+import hashlib
 import os
+import queue
+import signal
 import socket
 import subprocess
 import sys
@@ -17,20 +23,34 @@ import threading
 import time
 from typing import Optional
 
-from common.framing import recv_json, send_json
+from common.framing import pack_json, read_json, recv_json, send_json
+from common.journal import Journal
 
+# 非競爭情況下 FastRLock 取放鎖比 threading.RLock 快；沒裝就用標準版
+try:
+    from fastrlock.rlock import FastRLock as RLock
+except ImportError:
+    from threading import RLock
 
+# wait_room_update 長輪詢的上限秒數
+ROOM_WAIT_MAX = 30.0
+# 會呼叫商城或啟動 game server 的 op 交給 worker thread，其餘直接在 event loop 上處理
+BLOCKING_OPS = {"create_room", "start_room"}
+# 同時處理阻塞 op 的 worker 數與同時連線上限；超過上限的新連線直接回 SERVER_BUSY
+LOBBY_WORKERS = 16
+MAX_CLIENTS = 1024
+
+
+# 同一組密碼反覆登入時不必重算；快取的是明文 -> 雜湊，大小有上限
+@functools.lru_cache(maxsize=1024)
 def sha256_hex(s: str) -> str:
-    import hashlib
     return hashlib.sha256(s.encode("utf-8")).hexdigest()
 
 
-def _port_alive(host: str, port: int, timeout: float = 0.25) -> bool:
-    try:
-        with socket.create_connection((host, port), timeout=timeout):
-            return True
-    except OSError:
-        return False
+def _server_dead(room: dict) -> bool:
+    """房間標示 playing，但對應的 game server process 已經不在。"""
+    pid = (room.get("server") or {}).get("pid")
+    return room.get("status") == "playing" and bool(pid) and not _pid_alive(pid)
 
 
 def _pid_alive(pid: int) -> bool:
@@ -43,348 +63,571 @@ def _pid_alive(pid: int) -> bool:
         return False
 
 
+# start_room 等 game server 開始 listen 的上限秒數與輪詢間隔
+GAME_READY_TIMEOUT = 1.0
+GAME_READY_POLL = 0.025
+_TCP_LISTEN = "0A"
+
+
+def _port_listening(port: int) -> Optional[bool]:
+    """讀 /proc/net/tcp* 看本機是否已有 socket 在 listen 這個 port。
+
+    不能用 connect 試探：game server 只 accept 固定人數，試探連線會佔掉一個玩家名額。
+    沒有 /proc（非 Linux）時回傳 None，由呼叫端退回固定等待。
+    """
+    suffix = ":%04X" % port
+    seen = False
+    for path in ("/proc/net/tcp", "/proc/net/tcp6"):
+        try:
+            with open(path) as f:
+                next(f, None)
+                for line in f:
+                    fields = line.split(None, 4)
+                    if len(fields) > 3 and fields[3] == _TCP_LISTEN and fields[1].endswith(suffix):
+                        return True
+            seen = True
+        except OSError:
+            continue
+    return False if seen else None
+
+
+# 商城查詢結果的快取秒數
+LIST_GAMES_TTL = 60.0
+GAME_DETAIL_TTL = 10.0
+LAUNCH_INFO_TTL = 5.0
+# 到商城的閒置連線最多保留幾條
+STORE_POOL_SIZE = 4
+
+
 class StoreClient:
     """Tiny RPC helper talking to store_server.py"""
 
     def __init__(self, host: str, port: int):
         self.host = host
         self.port = port
+        # (op, gid, version) -> (到期時間, resp)；同一款遊戲反覆開房不必每次問商城
+        self._cache: dict[tuple, tuple[float, dict]] = {}
+        self._cache_lock = threading.Lock()
+        # 閒置連線池；同時在途的 RPC 超過上限時多開的連線用完即關
+        self._pool: queue.Queue = queue.LifoQueue(maxsize=STORE_POOL_SIZE)
+
+    def _connect(self) -> socket.socket:
+        s = socket.create_connection((self.host, self.port))
+        try:
+            s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            _ = recv_json(s)  # consume store hello
+        except OSError:
+            s.close()
+            raise
+        return s
 
     def _call(self, payload: dict) -> dict:
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-            s.connect((self.host, self.port))
-            _ = recv_json(s)  # consume store hello
-            send_json(s, payload)
-            resp = recv_json(s)
-            return resp or {"ok": False, "code": "NO_RESPONSE"}
+        # 從連線池取用已握手過的連線；池裡的連線若已被 server 關閉，改開新連線重送一次
+        for _ in range(2):
+            try:
+                s, fresh = self._pool.get_nowait(), False
+            except queue.Empty:
+                s, fresh = self._connect(), True
+            try:
+                send_json(s, payload)
+                resp = recv_json(s)
+            except OSError:
+                resp = None
+            if resp is None:
+                s.close()
+                if fresh:
+                    break
+                continue
+            try:
+                self._pool.put_nowait(s)
+            except queue.Full:
+                s.close()
+            return resp
+        return {"ok": False, "code": "NO_RESPONSE"}
+
+    def _cached_call(self, payload: dict, ttl: float) -> dict:
+        key = (payload["op"], payload.get("game_id"), payload.get("version"))
+        now = time.monotonic()
+        with self._cache_lock:
+            hit = self._cache.get(key)
+        if hit and hit[0] > now:
+            return hit[1]
+        resp = self._call(payload)
+        with self._cache_lock:
+            # 失敗的回應不快取，下次重新查詢
+            if resp.get("ok"):
+                self._cache[key] = (now + ttl, resp)
+            else:
+                self._cache.pop(key, None)
+        return resp
 
     def list_games(self):
-        return self._call({"op": "list_games"})
+        return self._cached_call({"op": "list_games"}, LIST_GAMES_TTL)
 
     def game_detail(self, gid: str):
-        return self._call({"op": "game_detail", "game_id": gid})
+        return self._cached_call({"op": "game_detail", "game_id": gid}, GAME_DETAIL_TTL)
 
     def get_launch_info(self, gid: str, version: Optional[str] = None):
         payload = {"op": "get_launch_info", "game_id": gid}
         if version:
             payload["version"] = version
-        return self._call(payload)
+        return self._cached_call(payload, LAUNCH_INFO_TTL)
+
+
+# 寫入執行緒被喚醒後再等一下，把同一波的多個修改合併成一次寫檔
+FLUSH_DEBOUNCE = 0.03
+# 只在記憶體中有意義的玩家欄位，重啟後一律視為離線，不寫進檔案
+EPHEMERAL_PLAYER_FIELDS = ("online",)
+
+
+def _persisted_player(doc: Optional[dict]) -> Optional[dict]:
+    if doc is None:
+        return None
+    return copy.deepcopy({k: v for k, v in doc.items() if k not in EPHEMERAL_PLAYER_FIELDS})
 
 
 class LobbyDB:
+    """玩家與房間分開上鎖；修改只記下變動的 key，由背景執行緒把那幾筆 append 到 journal。
+
+    需要同時持有兩把鎖時，一律先 players_lock 再 rooms_lock。
+    """
+
     def __init__(self, path: str):
         self.path = path
-        self.lock = threading.RLock()
-        if os.path.exists(path):
-            with open(path, "r", encoding="utf-8") as f:
-                self.db = json.load(f)
-        else:
-            self.db = {
-                "players": {},  # user -> {passwordHash, createdAt, online, downloads{gid:ver}}
-                "rooms": {},    # rid -> {...}
-            }
-            self._flush()
+        self.players_lock = RLock()
+        self.rooms_lock = RLock()
+        # 房間有變動時呼叫（不帶參數），讓 wait_room_update 的等待者醒來比對房間
+        self.room_listeners: list = []
+        self._dirty = threading.Event()
+        self._dirty_players: set = set()
+        self._dirty_rooms: set = set()
+        self._write_lock = threading.Lock()
+        self.journal = Journal(path)
+        self.db = self.journal.load({
+            "players": {},  # user -> {passwordHash, createdAt, lastLoginAt, downloads{gid:ver}} (+ online, 僅記憶體)
+            "rooms": {},    # rid -> {...}
+        })
+        # 舊檔可能存有 online；重啟後沒有人在線
+        for doc in self.db["players"].values():
+            doc["online"] = False
+        if not os.path.exists(path):
+            self.journal.compact(self.db)
+        threading.Thread(target=self._writer_loop, daemon=True).start()
 
     def normalize_room(self, rid: str):
-        """Reset room status if server already死掉."""
+        """Reset room status if server already死掉; 不需持有 rooms_lock.
+
+        絕大多數房間不在 playing 或 server 還活著，這時直接回傳不取鎖；
+        真的要改狀態才進鎖並重新檢查一次。
+        """
+        room = self.db["rooms"].get(rid)
+        if not room or not _server_dead(room):
+            return room
+        with self.rooms_lock:
+            return self._normalize_room_locked(rid)
+
+    def _normalize_room_locked(self, rid: str):
+        """normalize_room for callers that already hold rooms_lock."""
         room = self.db["rooms"].get(rid)
         if not room:
             return None
-        srv = room.get("server") or {}
-        pid = srv.get("pid")
-        if room.get("status") == "playing" and pid and not _pid_alive(pid):
+        if _server_dead(room):
             room["status"] = "idle"
             room["server"] = None
-            self._flush()
+            # 重啟後仍會以 pid 判斷重置，不必寫檔
+            self.notify_rooms()
         return room
 
+    def room_snapshot(self) -> list:
+        """所有房間的淺拷貝；鎖內只複製，檢查 game server 是否存活在鎖外進行。"""
+        with self.rooms_lock:
+            rooms = [dict(r) for r in self.db["rooms"].values()]
+        stale = [r for r in rooms if _server_dead(r)]
+        if stale:
+            with self.rooms_lock:
+                for r in stale:
+                    self._normalize_room_locked(r["id"])
+            for r in stale:
+                r["status"] = "idle"
+                r["server"] = None
+        return rooms
+
+    def mark_dirty(self, user: str):
+        """Caller holds players_lock."""
+        self._dirty_players.add(user)
+        self._dirty.set()
+
+    def mark_rooms_dirty(self, rid: str):
+        """Caller holds rooms_lock."""
+        self._dirty_rooms.add(rid)
+        self._dirty.set()
+        self.notify_rooms()
+
+    def notify_rooms(self):
+        """房間有變動但不需寫檔（例如 game server 結束後重置狀態）時只通知等待者。"""
+        for cb in self.room_listeners:
+            cb()
+
+    def _writer_loop(self):
+        while True:
+            self._dirty.wait()
+            time.sleep(FLUSH_DEBOUNCE)
+            self._dirty.clear()
+            try:
+                self._flush()
+            except OSError as exc:
+                print(f"[LOBBY] 寫入 {self.path} 失敗: {exc}")
+
     def _flush(self):
-        tmp = self.path + ".tmp"
-        with open(tmp, "w", encoding="utf-8") as f:
-            json.dump(self.db, f, ensure_ascii=False, indent=2)
-        os.replace(tmp, self.path)
+        with self._write_lock:
+            # 鎖內只複製變動過的那幾筆，序列化與寫檔都在鎖外
+            with self.players_lock:
+                users, self._dirty_players = self._dirty_players, set()
+                records = [("players", u, _persisted_player(self.db["players"].get(u))) for u in users]
+            with self.rooms_lock:
+                rids, self._dirty_rooms = self._dirty_rooms, set()
+                records += [("rooms", rid, copy.deepcopy(self.db["rooms"].get(rid))) for rid in rids]
+            self.journal.append(records)
+            if self.journal.should_compact():
+                self._compact()
+
+    def _compact(self):
+        with self.players_lock, self.rooms_lock:
+            snap = {
+                "players": {u: _persisted_player(doc) for u, doc in self.db["players"].items()},
+                "rooms": copy.deepcopy(self.db["rooms"]),
+            }
+        self.journal.compact(snap)
 
     def save(self):
-        with self.lock:
-            self._flush()
+        """同步寫出尚未落地的修改並壓實成 snapshot（關閉伺服器前呼叫）。"""
+        self._dirty.clear()
+        self._flush()
+        with self._write_lock:
+            self._compact()
+
 
+# reaper 檢查 game server 是否結束的間隔秒數
+REAP_INTERVAL = 0.25
 
-class LobbySession(threading.Thread):
-    def __init__(self, sock, addr, db: LobbyDB, store: StoreClient, game_host: str, game_bind_host: str, port_alloc):
-        super().__init__(daemon=True)
-        self.s = sock
-        self.a = addr
+
+class GameReaper:
+    """單一背景執行緒收掉所有 game server process，結束後把房間設回 idle。
+
+    取代每次開局各開一條 thread 去 p.wait()，執行緒數不再隨房間數成長。
+    """
+
+    def __init__(self, db: LobbyDB):
+        self.db = db
+        self._procs: dict[int, tuple[subprocess.Popen, str]] = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def track(self, p: subprocess.Popen, rid: str):
+        with self._lock:
+            self._procs[p.pid] = (p, rid)
+        self._wake.set()
+
+    def _run(self):
+        while True:
+            with self._lock:
+                procs = list(self._procs.items())
+                if not procs:
+                    self._wake.clear()
+            if not procs:
+                # 沒有進行中的遊戲就睡到下一次 track
+                self._wake.wait()
+                continue
+            for pid, (p, rid) in procs:
+                # poll() 會順便回收 zombie，os.kill(pid, 0) 對 zombie 仍回報存活
+                if p.poll() is None:
+                    continue
+                with self._lock:
+                    self._procs.pop(pid, None)
+                with self.db.rooms_lock:
+                    r = self.db.db["rooms"].get(rid)
+                    # 房間可能已經重開新的一局，只處理還指向這個 pid 的
+                    if r and (r.get("server") or {}).get("pid") == pid:
+                        r["status"] = "idle"
+                        r["server"] = None
+                        self.db.notify_rooms()
+            time.sleep(REAP_INTERVAL)
+
+
+class LobbySession:
+    """一條玩家連線的狀態；handle() 處理一個請求並回傳回應。"""
+
+    def __init__(self, db: LobbyDB, store: StoreClient, game_host: str, game_bind_host: str, port_alloc, reaper: "GameReaper"):
         self.db = db
         self.store = store
         self.game_host = game_host
         self.game_bind_host = game_bind_host
         self.alloc_port = port_alloc
+        self.reaper = reaper
         self.user: Optional[str] = None
+        # op -> 處理函式，每個請求一次 dict 查表
+        self._ops = {
+            "register": self._op_register,
+            "login": self._op_login,
+            "logout": self._op_logout,
+            "list_players": self._op_list_players,
+            "list_rooms": self._op_list_rooms,
+            "bulk_status": self._op_bulk_status,
+            "room_info": self._op_room_info,
+            "record_download": self._op_record_download,
+            "create_room": self._op_create_room,
+            "join_room": self._op_join_room,
+            "leave_room": self._op_leave_room,
+            "start_room": self._op_start_room,
+        }
 
     # ---------------------- helpers ----------------------
-    def send(self, obj: dict):
-        send_json(self.s, obj)
+    def list_players(self) -> list:
+        # 鎖內只取出需要的欄位，組回應 dict 放在鎖外
+        with self.db.players_lock:
+            snap = [(name, doc.get("online"), doc.get("lastLoginAt", 0)) for name, doc in self.db.db["players"].items()]
+        return [{"user": name, "online": bool(online), "lastLoginAt": last} for name, online, last in snap]
+
+    def list_rooms(self) -> list:
+        return self.db.room_snapshot()
+
+    def handle(self, req: dict) -> dict:
+        handler = self._ops.get(req.get("op"))
+        if handler is None:
+            return {"ok": False, "code": "UNKNOWN_OP"}
+        return handler(req)
+
+    # ---------------------- ops ----------------------
+    def _op_register(self, req: dict) -> dict:
+        u, p = req.get("user", ""), req.get("password", "")
+        # 雜湊與時間戳在鎖外算好，鎖內只動 dict
+        ph = sha256_hex(p)
+        now = int(time.time())
+        with self.db.players_lock:
+            if u in self.db.db["players"]:
+                return {"ok": False, "code": "USER_EXISTS"}
+            self.db.db["players"][u] = {
+                "passwordHash": ph,
+                "createdAt": now,
+                "online": False,
+                "downloads": {},
+            }
+            self.db.mark_dirty(u)
+        return {"ok": True, "code": "REGISTERED"}
+
+    def _op_login(self, req: dict) -> dict:
+        u, p = req.get("user", ""), req.get("password", "")
+        ph = sha256_hex(p)
+        now = int(time.time())
+        with self.db.players_lock:
+            doc = self.db.db["players"].get(u)
+            if not doc or doc.get("passwordHash") != ph:
+                return {"ok": False, "code": "AUTH_FAILED"}
+            # 上線狀態只在記憶體；lastLoginAt 隨下一次寫這筆玩家資料或壓實時落地
+            doc["online"] = True
+            doc["lastLoginAt"] = now
+            self.user = u
+        return {"ok": True, "code": "LOGIN_SUCCESS", "user": u}
+
+    def _op_logout(self, req: dict) -> dict:
+        if self.user:
+            with self.db.players_lock:
+                doc = self.db.db["players"].get(self.user)
+                if doc:
+                    doc["online"] = False
+        self.user = None
+        return {"ok": True, "code": "LOGOUT"}
+
+    def _op_list_players(self, req: dict) -> dict:
+        return {"ok": True, "code": "PLAYERS", "players": self.list_players()}
+
+    def _op_list_rooms(self, req: dict) -> dict:
+        return {"ok": True, "code": "ROOMS", "rooms": self.list_rooms()}
+
+    def _op_bulk_status(self, req: dict) -> dict:
+        # 大廳狀態頁一次取回玩家與房間，省一趟來回
+        return {"ok": True, "code": "STATUS", "players": self.list_players(), "rooms": self.list_rooms()}
+
+    def _op_room_info(self, req: dict) -> dict:
+        rid = req.get("room")
+        room = self.db.normalize_room(rid)
+        if not room:
+            return {"ok": False, "code": "NO_SUCH_ROOM"}
+        return {"ok": True, "code": "ROOM", "room": room}
 
-    def require_auth(self) -> bool:
+    def _op_record_download(self, req: dict) -> dict:
         if not self.user:
-            self.send({"ok": False, "code": "AUTH_REQUIRED"})
-            return False
-        return True
+            return {"ok": False, "code": "AUTH_REQUIRED"}
+        gid = req.get("game_id")
+        version = req.get("version")
+        if not gid or not version:
+            return {"ok": False, "code": "BAD_FIELD"}
+        with self.db.players_lock:
+            doc = self.db.db["players"].get(self.user)
+            if not doc:
+                return {"ok": False, "code": "AUTH_LOST"}
+            doc.setdefault("downloads", {})[gid] = version
+            self.db.mark_dirty(self.user)
+        return {"ok": True, "code": "RECORDED"}
+
+    def _op_create_room(self, req: dict) -> dict:
+        if not self.user:
+            return {"ok": False, "code": "AUTH_REQUIRED"}
+        rid = req.get("room") or f"room-{int(time.time())}"
+        gid = req.get("game_id")
+        if not gid:
+            return {"ok": False, "code": "BAD_FIELD"}
+        lresp = self.store.game_detail(gid)
+        if not lresp.get("ok"):
+            return {"ok": False, "code": "GAME_NOT_FOUND"}
+        g = lresp.get("game", {})
+        version = g.get("latestVersion") or (g.get("versions") or [{}])[-1].get("version")
+        max_players = g.get("maxPlayers", 2)
+        with self.db.rooms_lock:
+            if rid in self.db.db["rooms"]:
+                return {"ok": False, "code": "ROOM_EXISTS"}
+            room = {
+                "id": rid,
+                "host": self.user,
+                "members": [self.user],
+                "game_id": gid,
+                "game_version": version,
+                "status": "idle",
+                "max_players": max_players,
+            }
+            self.db.db["rooms"][rid] = room
+            self.db.mark_rooms_dirty(rid)
+        return {"ok": True, "code": "ROOM_CREATED", "room": room}
 
-    def run(self):
+    def _op_join_room(self, req: dict) -> dict:
+        if not self.user:
+            return {"ok": False, "code": "AUTH_REQUIRED"}
+        rid = req.get("room")
+        if not rid:
+            return {"ok": False, "code": "BAD_FIELD"}
+        with self.db.rooms_lock:
+            # 若房間標示 playing 但 game server 已死，重置為 idle
+            room = self.db._normalize_room_locked(rid)
+            if not room:
+                return {"ok": False, "code": "NO_SUCH_ROOM"}
+            members = list(room.get("members", []))
+            if self.user in members:
+                return {"ok": True, "code": "JOINED", "room": room}
+            if room.get("status") == "playing":
+                return {"ok": False, "code": "IN_GAME"}
+            if len(members) >= int(room.get("max_players", 2)):
+                return {"ok": False, "code": "ROOM_FULL"}
+            members.append(self.user)
+            room["members"] = members
+            self.db.mark_rooms_dirty(rid)
+        return {"ok": True, "code": "JOINED", "room": room}
+
+    def _op_leave_room(self, req: dict) -> dict:
+        if not self.user:
+            return {"ok": False, "code": "AUTH_REQUIRED"}
+        rid = req.get("room")
+        with self.db.rooms_lock:
+            room = self.db.db["rooms"].get(rid)
+            if not room:
+                return {"ok": False, "code": "NO_SUCH_ROOM"}
+            members = [m for m in room.get("members", []) if m != self.user]
+            room["members"] = members
+            if room.get("host") == self.user:
+                room["host"] = members[0] if members else None
+            if not members:
+                del self.db.db["rooms"][rid]
+            self.db.mark_rooms_dirty(rid)
+        return {"ok": True, "code": "LEFT"}
+
+    def _op_start_room(self, req: dict) -> dict:
+        if not self.user:
+            return {"ok": False, "code": "AUTH_REQUIRED"}
+        rid = req.get("room")
+        with self.db.rooms_lock:
+            room = self.db._normalize_room_locked(rid)
+            if not room:
+                return {"ok": False, "code": "NO_SUCH_ROOM"}
+            if room.get("host") != self.user:
+                return {"ok": False, "code": "NOT_HOST"}
+            if room.get("status") == "playing":
+                srv = room.get("server") or {}
+                pid = srv.get("pid")
+                if pid and _pid_alive(pid):
+                    return {"ok": True, "code": "ALREADY_PLAYING", "room": room}
+                # server died -> reset
+                room["status"] = "idle"
+                room["server"] = None
+                self.db.mark_rooms_dirty(rid)
+            members = list(room.get("members", []))
+            if not members:
+                return {"ok": False, "code": "EMPTY_ROOM"}
+            if len(members) < 2:
+                return {"ok": False, "code": "NEED_TWO_PLAYERS"}
+            gid = room.get("game_id")
+            gver = room.get("game_version")
+        # fetch launch info outside lock
+        lresp = self.store.get_launch_info(gid, gver)
+        if not lresp.get("ok"):
+            # fallback: try latest version once if missing/null
+            if gver:
+                return {"ok": False, "code": lresp.get("code", "LAUNCH_FAIL")}
+            alt = self.store.get_launch_info(gid, None)
+            if not alt.get("ok"):
+                return {"ok": False, "code": alt.get("code", "LAUNCH_FAIL")}
+            lresp = alt
+            with self.db.rooms_lock:
+                room = self.db.db["rooms"].get(rid)
+                if room:
+                    room["game_version"] = lresp["info"]["version"]
+                    self.db.mark_rooms_dirty(rid)
+        info = lresp.get("info", {})
+        min_players = int(info.get("min_players", 2))
+        if len(members) < min_players:
+            return {"ok": False, "code": "NEED_MIN_PLAYERS", "required": min_players}
+        port = self.alloc_port()
+        cmd = [
+            sys.executable,
+            info.get("server_entry", "server.py"),
+            "--host", self.game_bind_host,
+            "--port", str(port),
+            "--room", rid,
+            "--players", ",".join(members),
+        ]
+        env = os.environ.copy()
+        env["PYTHONPATH"] = info.get("path", ".") + os.pathsep + env.get("PYTHONPATH", "")
         try:
-            self.send({"ok": True, "code": "HELLO", "msg": "Lobby ready"})
-            while True:
-                req = recv_json(self.s)
-                if not req:
-                    break
-                op = req.get("op")
-                if op == "register":
-                    u, p = req.get("user", ""), req.get("password", "")
-                    with self.db.lock:
-                        if u in self.db.db["players"]:
-                            self.send({"ok": False, "code": "USER_EXISTS"}); continue
-                        self.db.db["players"][u] = {
-                            "passwordHash": sha256_hex(p),
-                            "createdAt": int(time.time()),
-                            "online": False,
-                            "downloads": {},
-                        }
-                        self.db._flush()
-                    self.send({"ok": True, "code": "REGISTERED"})
-
-                elif op == "login":
-                    u, p = req.get("user", ""), req.get("password", "")
-                    with self.db.lock:
-                        doc = self.db.db["players"].get(u)
-                        if not doc or doc.get("passwordHash") != sha256_hex(p):
-                            self.send({"ok": False, "code": "AUTH_FAILED"}); continue
-                        doc["online"] = True
-                        doc["lastLoginAt"] = int(time.time())
-                        self.db._flush()
-                        self.user = u
-                    self.send({"ok": True, "code": "LOGIN_SUCCESS", "user": u})
-
-                elif op == "logout":
-                    if self.user:
-                        with self.db.lock:
-                            doc = self.db.db["players"].get(self.user)
-                            if doc:
-                                doc["online"] = False
-                                self.db._flush()
-                    self.user = None
-                    self.send({"ok": True, "code": "LOGOUT"})
-
-                elif op == "list_players":
-                    with self.db.lock:
-                        users = []
-                        for name, doc in self.db.db["players"].items():
-                            users.append({"user": name, "online": bool(doc.get("online")), "lastLoginAt": doc.get("lastLoginAt", 0)})
-                    self.send({"ok": True, "code": "PLAYERS", "players": users})
-
-                elif op == "list_rooms":
-                    with self.db.lock:
-                        rooms = []
-                        for rid in list(self.db.db["rooms"].keys()):
-                            r = self.db.normalize_room(rid)
-                            if r:
-                                rooms.append(r)
-                    self.send({"ok": True, "code": "ROOMS", "rooms": rooms})
-
-                elif op == "room_info":
-                    rid = req.get("room")
-                    with self.db.lock:
-                        room = self.db.normalize_room(rid)
-                    if not room:
-                        self.send({"ok": False, "code": "NO_SUCH_ROOM"}); continue
-                    self.send({"ok": True, "code": "ROOM", "room": room})
-
-                elif op == "record_download":
-                    if not self.require_auth():
-                        continue
-                    gid = req.get("game_id")
-                    version = req.get("version")
-                    if not gid or not version:
-                        self.send({"ok": False, "code": "BAD_FIELD"}); continue
-                    with self.db.lock:
-                        doc = self.db.db["players"].get(self.user)
-                        if not doc:
-                            self.send({"ok": False, "code": "AUTH_LOST"}); continue
-                        doc.setdefault("downloads", {})[gid] = version
-                        self.db._flush()
-                    self.send({"ok": True, "code": "RECORDED"})
-
-                elif op == "create_room":
-                    if not self.require_auth():
-                        continue
-                    rid = req.get("room") or f"room-{int(time.time())}"
-                    gid = req.get("game_id")
-                    if not gid:
-                        self.send({"ok": False, "code": "BAD_FIELD"}); continue
-                    lresp = self.store.game_detail(gid)
-                    if not lresp.get("ok"):
-                        self.send({"ok": False, "code": "GAME_NOT_FOUND"}); continue
-                    g = lresp.get("game", {})
-                    version = g.get("latestVersion") or (g.get("versions") or [{}])[-1].get("version")
-                    max_players = g.get("maxPlayers", 2)
-                    with self.db.lock:
-                        if rid in self.db.db["rooms"]:
-                            self.send({"ok": False, "code": "ROOM_EXISTS"}); continue
-                        room = {
-                            "id": rid,
-                            "host": self.user,
-                            "members": [self.user],
-                            "game_id": gid,
-                            "game_version": version,
-                            "status": "idle",
-                            "max_players": max_players,
-                        }
-                        self.db.db["rooms"][rid] = room
-                        self.db._flush()
-                    self.send({"ok": True, "code": "ROOM_CREATED", "room": room})
-
-                elif op == "join_room":
-                    if not self.require_auth():
-                        continue
-                    rid = req.get("room")
-                    if not rid:
-                        self.send({"ok": False, "code": "BAD_FIELD"}); continue
-                    with self.db.lock:
-                        room = self.db.normalize_room(rid)
-                        if not room:
-                            self.send({"ok": False, "code": "NO_SUCH_ROOM"}); continue
-                        # 若房間標示 playing 但 game server 已死，重置為 idle
-                        srv = room.get("server") or {}
-                        pid = srv.get("pid")
-                        if room.get("status") == "playing" and pid and not _pid_alive(pid):
-                            room["status"] = "idle"
-                            room["server"] = None
-                            self.db._flush()
-                        members = list(room.get("members", []))
-                        if self.user in members:
-                            self.send({"ok": True, "code": "JOINED", "room": room}); continue
-                        if room.get("status") == "playing":
-                            self.send({"ok": False, "code": "IN_GAME"}); continue
-                        if len(members) >= int(room.get("max_players", 2)):
-                            self.send({"ok": False, "code": "ROOM_FULL"}); continue
-                        members.append(self.user)
-                        room["members"] = members
-                        self.db._flush()
-                    self.send({"ok": True, "code": "JOINED", "room": room})
-
-                elif op == "leave_room":
-                    if not self.require_auth():
-                        continue
-                    rid = req.get("room")
-                    with self.db.lock:
-                        room = self.db.db["rooms"].get(rid)
-                        if not room:
-                            self.send({"ok": False, "code": "NO_SUCH_ROOM"}); continue
-                        members = [m for m in room.get("members", []) if m != self.user]
-                        room["members"] = members
-                        if room.get("host") == self.user:
-                            room["host"] = members[0] if members else None
-                        if not members:
-                            del self.db.db["rooms"][rid]
-                        self.db._flush()
-                    self.send({"ok": True, "code": "LEFT"})
-
-                elif op == "start_room":
-                    if not self.require_auth():
-                        continue
-                    rid = req.get("room")
-                    with self.db.lock:
-                        room = self.db.normalize_room(rid)
-                        if not room:
-                            self.send({"ok": False, "code": "NO_SUCH_ROOM"}); continue
-                        if room.get("host") != self.user:
-                            self.send({"ok": False, "code": "NOT_HOST"}); continue
-                        if room.get("status") == "playing":
-                            srv = room.get("server") or {}
-                            pid = srv.get("pid")
-                            if pid and _pid_alive(pid):
-                                self.send({"ok": True, "code": "ALREADY_PLAYING", "room": room}); continue
-                            # server died -> reset
-                            room["status"] = "idle"
-                            room["server"] = None
-                            self.db._flush()
-                        members = list(room.get("members", []))
-                        if not members:
-                            self.send({"ok": False, "code": "EMPTY_ROOM"}); continue
-                        if len(members) < 2:
-                            self.send({"ok": False, "code": "NEED_TWO_PLAYERS"}); continue
-                        gid = room.get("game_id")
-                        gver = room.get("game_version")
-                    # fetch launch info outside lock
-                    lresp = self.store.get_launch_info(gid, gver)
-                    if not lresp.get("ok"):
-                        # fallback: try latest version once if missing/null
-                        if gver:
-                            self.send({"ok": False, "code": lresp.get("code", "LAUNCH_FAIL")}); continue
-                        alt = self.store.get_launch_info(gid, None)
-                        if not alt.get("ok"):
-                            self.send({"ok": False, "code": alt.get("code", "LAUNCH_FAIL")}); continue
-                        lresp = alt
-                        with self.db.lock:
-                            room = self.db.db["rooms"].get(rid)
-                            if room:
-                                room["game_version"] = lresp["info"]["version"]
-                                self.db._flush()
-                    info = lresp.get("info", {})
-                    min_players = int(info.get("min_players", 2))
-                    if len(members) < min_players:
-                        self.send({"ok": False, "code": "NEED_MIN_PLAYERS", "required": min_players}); continue
-                    port = self.alloc_port()
-                    cmd = [
-                        sys.executable,
-                        info.get("server_entry", "server.py"),
-                        "--host", self.game_bind_host,
-                        "--port", str(port),
-                        "--room", rid,
-                        "--players", ",".join(members),
-                    ]
-                    env = os.environ.copy()
-                    env["PYTHONPATH"] = info.get("path", ".") + os.pathsep + env.get("PYTHONPATH", "")
-                    try:
-                        p = subprocess.Popen(
-                            cmd,
-                            cwd=info.get("path"),
-                            env=env,
-                            stdout=subprocess.DEVNULL,
-                            stderr=subprocess.DEVNULL,
-                        )
-                    except OSError as exc:
-                        self.send({"ok": False, "code": "SPAWN_FAIL", "msg": str(exc)}); continue
-                    # wait briefly to ensure process stays alive / port binds
-                    time.sleep(0.5)
-                    rc = p.poll()
-                    if rc is not None:
-                        self.send({"ok": False, "code": "GAME_NOT_READY", "returncode": rc}); continue
-                    with self.db.lock:
-                        room = self.db.db["rooms"].get(rid)
-                        if room:
-                            room["status"] = "playing"
-                            room["server"] = {"host": self.game_host, "port": port, "pid": p.pid}
-                            self.db._flush()
-                    # 背景監看：結束後自動把房間狀態設回 idle
-                    def _watch(pid: int, rid: str):
-                        p.wait()
-                        with self.db.lock:
-                            r = self.db.db["rooms"].get(rid)
-                            if r:
-                                r["status"] = "idle"
-                                r["server"] = None
-                                self.db._flush()
-                    threading.Thread(target=_watch, args=(p.pid, rid), daemon=True).start()
-                    self.send({"ok": True, "code": "GAME_STARTED", "server": {"host": self.game_host, "port": port}})
-
-                else:
-                    self.send({"ok": False, "code": "UNKNOWN_OP"})
-        finally:
-            try:
-                self.s.close()
-            except Exception:
-                pass
+            p = subprocess.Popen(
+                cmd,
+                cwd=info.get("path"),
+                env=env,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+            )
+        except OSError as exc:
+            return {"ok": False, "code": "SPAWN_FAIL", "msg": str(exc)}
+        # 等到 game server 開始 listen 或提早結束，不再固定睡 0.5 秒
+        deadline = time.monotonic() + GAME_READY_TIMEOUT
+        while p.poll() is None and time.monotonic() < deadline:
+            ready = _port_listening(port)
+            if ready is None:
+                time.sleep(0.5)
+                break
+            if ready:
+                break
+            time.sleep(GAME_READY_POLL)
+        rc = p.poll()
+        if rc is not None:
+            return {"ok": False, "code": "GAME_NOT_READY", "returncode": rc}
+        with self.db.rooms_lock:
+            room = self.db.db["rooms"].get(rid)
+            if room:
+                room["status"] = "playing"
+                room["server"] = {"host": self.game_host, "port": port, "pid": p.pid}
+                self.db.mark_rooms_dirty(rid)
+        # 結束後由 reaper 把房間狀態設回 idle
+        self.reaper.track(p, rid)
+        return {"ok": True, "code": "GAME_STARTED", "server": {"host": self.game_host, "port": port}}
 
 
 class LobbyServer:
@@ -396,7 +639,8 @@ class LobbyServer:
         self.game_host = game_host
         self.game_bind_host = game_bind_host
         self.next_port = game_port_start
-        self.lock = threading.RLock()
+        self.lock = RLock()
+        self.reaper = GameReaper(self.db)
 
     def alloc_port(self) -> int:
         with self.lock:
@@ -408,12 +652,114 @@ class LobbyServer:
 
     def serve(self):
         print(f"[LOBBY] {self.host}:{self.port} (store={self.store.host}:{self.store.port})")
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as srv:
-            srv.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            srv.bind((self.host, self.port)); srv.listen(128)
+        try:
+            asyncio.run(self._main())
+        except KeyboardInterrupt:
+            pass
+        finally:
+            # 背景寫入可能還沒落地，結束前同步寫一次
+            self.db.save()
+
+    async def _main(self):
+        loop = asyncio.get_running_loop()
+        self._loop = loop
+        self._room_event = asyncio.Event()
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=LOBBY_WORKERS, thread_name_prefix="lobby")
+        loop.set_default_executor(executor)
+        self.db.room_listeners.append(self._on_rooms_changed)
+        stop = asyncio.Event()
+        # SIGTERM 也走正常結束流程，讓 serve() 的 finally 把資料寫完
+        try:
+            loop.add_signal_handler(signal.SIGTERM, stop.set)
+        except (NotImplementedError, RuntimeError):
+            signal.signal(signal.SIGTERM, lambda *_: loop.call_soon_threadsafe(stop.set))
+        self._writers: set = set()
+        server = await asyncio.start_server(self._serve_client, self.host, self.port, reuse_address=True, backlog=128)
+        async with server:
+            await stop.wait()
+            # 主動關掉所有連線，讓每個 session 正常走完而不是在 loop 收尾時被取消
+            for w in list(self._writers):
+                w.close()
+            while self._writers:
+                await asyncio.sleep(0.01)
+
+    def _on_rooms_changed(self):
+        # 可能在 worker / 監看執行緒呼叫，轉回 event loop 再喚醒等待者
+        try:
+            self._loop.call_soon_threadsafe(self._wake_room_waiters)
+        except RuntimeError:
+            pass  # loop 已關閉
+
+    def _wake_room_waiters(self):
+        ev, self._room_event = self._room_event, asyncio.Event()
+        ev.set()
+
+    async def _serve_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        # 大廳都是一問一答的小封包，關掉 Nagle
+        sock = writer.get_extra_info("socket")
+        if sock is not None:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if len(self._writers) >= MAX_CLIENTS:
+            writer.write(pack_json({"ok": False, "code": "SERVER_BUSY", "msg": "Lobby is full"}))
+            writer.close()
+            return
+        session = LobbySession(self.db, self.store, self.game_host, self.game_bind_host, self.alloc_port, self.reaper)
+        loop = asyncio.get_running_loop()
+        pending = None  # 長輪詢期間已開始讀取的下一個請求
+        self._writers.add(writer)
+        try:
+            writer.write(pack_json({"ok": True, "code": "HELLO", "msg": "Lobby ready"}))
             while True:
-                c, a = srv.accept()
-                LobbySession(c, a, self.db, self.store, self.game_host, self.game_bind_host, self.alloc_port).start()
+                req = await (pending or read_json(reader))
+                pending = None
+                if not req:
+                    break
+                op = req.get("op")
+                if op == "wait_room_update":
+                    resp, pending = await self._wait_room_update(req, reader)
+                elif op in BLOCKING_OPS:
+                    resp = await loop.run_in_executor(None, session.handle, req)
+                else:
+                    resp = session.handle(req)
+                writer.write(pack_json(resp))
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            if pending is not None:
+                pending.cancel()
+            writer.close()
+            self._writers.discard(writer)
+
+    async def _wait_room_update(self, req: dict, reader: asyncio.StreamReader):
+        """長輪詢：房間內容與 client 已知的 known 不同才回傳；逾時則回傳目前狀態。
+
+        等待期間同時讀取下一個請求，client 一送來新請求就結束等待；
+        回傳 (回應, 讀取下一個請求的 task)。
+        """
+        rid = req.get("room")
+        known = req.get("known")
+        try:
+            timeout = min(float(req.get("timeout", 10)), ROOM_WAIT_MAX)
+        except (TypeError, ValueError):
+            timeout = 10.0
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        next_req = asyncio.ensure_future(read_json(reader))
+        while True:
+            # 先取 event 再檢查房間，檢查之後的變動一定會 set 這個 event
+            ev = self._room_event
+            room = self.db.normalize_room(rid)
+            room = dict(room) if room else None
+            left = deadline - loop.time()
+            if not room or room != known or left <= 0 or next_req.done():
+                break
+            woke = asyncio.ensure_future(ev.wait())
+            await asyncio.wait({next_req, woke}, timeout=left, return_when=asyncio.FIRST_COMPLETED)
+            woke.cancel()
+        if not room:
+            return {"ok": False, "code": "NO_SUCH_ROOM"}, next_req
+        return {"ok": True, "code": "ROOM", "room": room, "changed": room != known}, next_req
 
 
 if __name__ == "__main__":
@@ -3,28 +3,51 @@
 import argparse
 import json
 import socket
+import struct
 import sys
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# 有 orjson 就用（直接輸出 UTF-8 bytes）；import 時就決定實作，熱路徑上不再每次判斷
+if orjson is not None:
+    _dumps = orjson.dumps
+    _loads = orjson.loads
+else:
+    _encode = json.JSONEncoder(separators=(",", ":")).encode
+
+    def _dumps(obj) -> bytes:
+        return _encode(obj).encode("utf-8")
+
+    def _loads(data) -> dict:
+        return json.loads(data.decode("utf-8"))
+
+
+# 4-byte big-endian 長度標頭；預先編好的 Struct 比每次 int.to_bytes 省事
+_HDR = struct.Struct(">I")
+MAX_LEN = 65536
 
 
 def send_json(sock: socket.socket, obj: dict):
-    data = json.dumps(obj).encode("utf-8")
-    hdr = len(data).to_bytes(4, "big")
-    sock.sendall(hdr + data)
+    data = _dumps(obj)
+    sock.sendall(_HDR.pack(len(data)) + data)
 
 
-def recv_json(sock: socket.socket) -> dict | None:
-    hdr = sock.recv(4)
-    if not hdr:
+def recv_json(rf) -> dict | None:
+    """從 sock.makefile("rb") 讀一個 frame；緩衝讀取在 C 層補收，小 frame 常常一次 recv 就拿齊。"""
+    hdr = rf.read(_HDR.size)
+    if len(hdr) < _HDR.size:
+        return None
+    (n,) = _HDR.unpack(hdr)
+    if n <= 0 or n > MAX_LEN:
+        return None
+    body = rf.read(n)
+    if len(body) < n:
         return None
-    n = int.from_bytes(hdr, "big")
-    body = b""
-    while len(body) < n:
-        chunk = sock.recv(n - len(body))
-        if not chunk:
-            return None
-        body += chunk
     try:
-        return json.loads(body.decode("utf-8"))
+        return _loads(body)
     except Exception:
         return None
 
@@ -36,13 +59,17 @@ def main():
     ap.add_argument("--user", default="player")
     args = ap.parse_args()
 
-    with socket.create_connection((args.host, args.port)) as s:
+    with socket.create_connection((args.host, args.port)) as s, s.makefile("rb", buffering=MAX_LEN) as rf:
+        s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
         send_json(s, {"op": "hello", "user": args.user})
         print(f"已連線到 Dice Race {args.host}:{args.port}，玩家 {args.user}")
         while True:
-            msg = recv_json(s)
+            msg = recv_json(rf)
             if not msg:
                 break
+            # 伺服器會把同一回合的多則訊息合併在一個 frame 的 texts 裡
+            for text in msg.get("texts", ()):
+                print(text)
             op = msg.get("op")
             if op == "msg":
                 print(msg.get("text", ""))
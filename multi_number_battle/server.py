@@ -2,31 +2,59 @@
 """Dice Race Party server: 3-4 players take turns rolling to reach 30 points."""
 import argparse
 import json
+import queue
 import random
 import socket
+import struct
 import threading
 import time
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# 有 orjson 就用（直接輸出 UTF-8 bytes）；import 時就決定實作，熱路徑上不再每次判斷
+if orjson is not None:
+    _dumps = orjson.dumps
+    _loads = orjson.loads
+else:
+    _encode = json.JSONEncoder(separators=(",", ":")).encode
+
+    def _dumps(obj) -> bytes:
+        return _encode(obj).encode("utf-8")
+
+    def _loads(data) -> dict:
+        return json.loads(data.decode("utf-8"))
+
+
+# 4-byte big-endian 長度標頭；預先編好的 Struct 比每次 int.to_bytes 省事
+_HDR = struct.Struct(">I")
+MAX_LEN = 65536
+
+
+def _frame(obj: dict) -> bytes:
+    data = _dumps(obj)
+    return _HDR.pack(len(data)) + data
 
 
 def send_json(sock: socket.socket, obj: dict):
-    data = json.dumps(obj).encode("utf-8")
-    hdr = len(data).to_bytes(4, "big")
-    sock.sendall(hdr + data)
+    sock.sendall(_frame(obj))
 
 
-def recv_json(sock: socket.socket):
-    hdr = sock.recv(4)
-    if not hdr:
+def recv_json(rf) -> dict | None:
+    """從 sock.makefile("rb") 讀一個 frame；緩衝讀取在 C 層補收，小 frame 常常一次 recv 就拿齊。"""
+    hdr = rf.read(_HDR.size)
+    if len(hdr) < _HDR.size:
+        return None
+    (n,) = _HDR.unpack(hdr)
+    if n <= 0 or n > MAX_LEN:
+        return None
+    body = rf.read(n)
+    if len(body) < n:
         return None
-    n = int.from_bytes(hdr, "big")
-    body = b""
-    while len(body) < n:
-        chunk = sock.recv(n - len(body))
-        if not chunk:
-            return None
-        body += chunk
     try:
-        return json.loads(body.decode("utf-8"))
+        return _loads(body)
     except Exception:
         return None
 
@@ -35,44 +63,69 @@ class PlayerConn(threading.Thread):
     def __init__(self, sock, addr):
         super().__init__(daemon=True)
         self.s = sock
+        self.rf = sock.makefile("rb", buffering=MAX_LEN)
         self.a = addr
         self.user = None
-        self.inbox = []
-        self.lock = threading.RLock()
+        self.inbox = queue.Queue()
+        # 尚未送出的文字訊息；下一個送給此玩家的 frame 會一併帶上（"texts" 欄位）
+        self.pending: list[str] = []
+
+    def say(self, text: str):
+        self.pending.append(text)
 
     def send(self, obj: dict):
+        # pending 只由遊戲主迴圈存取
+        if self.pending:
+            obj = {**obj, "texts": self.pending}
+            self.pending = []
+        self._write(obj)
+
+    def _write(self, obj: dict):
+        self._write_frame(_frame(obj))
+
+    def _write_frame(self, frame: bytes):
         try:
-            send_json(self.s, obj)
+            self.s.sendall(frame)
         except OSError:
             pass
 
     def run(self):
         try:
-            hello = recv_json(self.s)
+            hello = recv_json(self.rf)
             if not hello:
                 return
             self.user = hello.get("user") or f"player-{self.a[1]}"
-            self.send({"op": "msg", "text": f"Welcome {self.user}"})
+            self._write({"op": "msg", "text": f"Welcome {self.user}"})
             while True:
-                data = recv_json(self.s)
+                data = recv_json(self.rf)
                 if not data:
                     break
-                with self.lock:
-                    self.inbox.append(data)
+                self.inbox.put(data)
         finally:
             try:
+                self.rf.close()
                 self.s.close()
             except OSError:
                 pass
 
     def pop_msg(self, timeout=15.0):
-        deadline = time.time() + timeout
-        while time.time() < deadline:
-            with self.lock:
-                if self.inbox:
-                    return self.inbox.pop(0)
-            time.sleep(0.05)
-        return None
+        # 阻塞等待，訊息一到立即喚醒，不再定時輪詢
+        try:
+            return self.inbox.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+def broadcast(conns: list, obj: dict):
+    """送 obj（連同各自累積的 texts）給多位玩家；內容相同的 frame 只編碼一次。"""
+    frames: dict[tuple, bytes] = {}
+    for c in conns:
+        key = tuple(c.pending)
+        frame = frames.get(key)
+        if frame is None:
+            frame = frames[key] = _frame({**obj, "texts": c.pending} if c.pending else obj)
+        c.pending = []
+        c._write_frame(frame)
 
 
 def main():
@@ -100,6 +153,8 @@ def main():
                 c, a = srv.accept()
             except socket.timeout:
                 continue
+            # 回合訊息很小，不要讓 Nagle 延遲送出
+            c.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
             p = PlayerConn(c, a)
             p.start()
             clients.append(p)
@@ -111,27 +166,29 @@ def main():
     print("[GAME] all players connected:", [c.user for c in clients])
     target = 15
     for c in clients:
-        c.send({"op": "msg", "text": f"房間 {args.room} 開始！輪流擲骰，先達 {target} 分獲勝。"})
+        c.say(f"房間 {args.room} 開始！輪流擲骰，先達 {target} 分獲勝。")
 
     scores = {c.user: 0 for c in clients}
     turn = 0
     winner = None
     while not winner and turn < 200:
         player = clients[turn % len(clients)]
+        # 每回合每位玩家只送一個 frame：其他人收到累積的訊息，輪到的玩家訊息併在 your_turn 裡
+        broadcast([c for c in clients if c is not player and c.pending], {"op": "msgs"})
         player.send({"op": "your_turn"})
         msg = player.pop_msg(timeout=20.0)
         if not msg:
-            player.send({"op": "msg", "text": "超時跳過這回合"})
+            player.say("超時跳過這回合")
             turn += 1
             continue
         if msg.get("op") != "roll":
-            player.send({"op": "msg", "text": "請輸入 roll 以擲骰"})
+            player.say("請輸入 roll 以擲骰")
             turn += 1
             continue
         roll = random.randint(1, 6)
         scores[player.user] += roll
         for c in clients:
-            c.send({"op": "msg", "text": f"{player.user} 擲出 {roll} 點，總分 {scores[player.user]} / {target}"})
+            c.say(f"{player.user} 擲出 {roll} 點，總分 {scores[player.user]} / {target}")
         if scores[player.user] >= target:
             winner = player.user
             break
@@ -139,12 +196,11 @@ def main():
 
     if winner:
         for c in clients:
-            c.send({"op": "msg", "text": f"{winner} 抵達 30 分獲勝！"})
+            c.say(f"{winner} 抵達 30 分獲勝！")
     else:
         for c in clients:
-            c.send({"op": "msg", "text": "時間到，無人達標"} )
-    for c in clients:
-        c.send({"op": "end"})
+            c.say("時間到，無人達標")
+    broadcast(clients, {"op": "end"})
     print("[GAME] finished")
 
 
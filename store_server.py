@@ -12,21 +12,60 @@ where both the original zip and an extracted directory are kept. The extracted
 dir is what the lobby server uses to spawn the game server entrypoint.
 """
 import argparse
-import base64
+import copy
+import functools
 import hashlib
 import json
 import os
+import re
+import secrets
 import shutil
+import signal
+import sys
+import tempfile
 import threading
 import time
-
-from common.framing import recv_json, send_json
+import zipfile
+
+from common.framing import BULK_SOCK_BUF, MAX_LEN, recv_chunks, recv_json, send_chunks, send_json
+from common.journal import Journal
+
+# 寫入執行緒被喚醒後再等一下，同一波的評分/下載合併成一次 append
+FLUSH_DEBOUNCE = 0.1
+# game_details_batch 一次最多回傳幾款，避免回應超過單一 frame 上限
+DETAILS_BATCH_MAX = 8
+# 預取只帶玩家端會顯示的前幾則評論，整批編碼後也要留點空間給 frame 其他欄位
+DETAILS_BATCH_RATINGS = 5
+DETAILS_BATCH_BYTES = MAX_LEN - 1024
+# 上傳 zip 解壓後的總大小與壓縮比上限，擋掉 zip bomb
+BUNDLE_MAX_BYTES = 100 * 1024 * 1024
+BUNDLE_MAX_RATIO = 100
+
+
+def check_bundle_zip(zf: zipfile.ZipFile) -> str | None:
+    """解壓前只看中央目錄檢查路徑與大小；有問題回傳錯誤碼。"""
+    total = packed = 0
+    for info in zf.infolist():
+        name = info.filename.replace("\\", "/")
+        if name.startswith("/") or ".." in name.split("/"):
+            return "BAD_PATH"
+        total += info.file_size
+        packed += info.compress_size
+    if total > BUNDLE_MAX_BYTES or total > max(packed, 1) * BUNDLE_MAX_RATIO:
+        return "ARCHIVE_TOO_LARGE"
+    return None
 
 
 def validate_game_bundle(gdir: str) -> tuple[bool, str, dict]:
     """Basic validation to防呆 developer上傳內容."""
+    # 讀一次目錄內容，單純檔名直接查集合，不必每個檔案各 stat 一次
+    try:
+        with os.scandir(gdir) as it:
+            names = {e.name for e in it}
+    except OSError:
+        names = set()
     cfg_path = os.path.join(gdir, "game_config.json")
-    if not os.path.exists(cfg_path):
+    if "game_config.json" not in names:
         return False, "CONFIG_MISSING", {"missing": ["game_config.json"]}
     try:
         with open(cfg_path, "r", encoding="utf-8") as f:
@@ -40,31 +79,38 @@ def validate_game_bundle(gdir: str) -> tuple[bool, str, dict]:
     for key in ("server_entry", "client_entry"):
         entry = cfg.get(key)
         if entry:
-            ep = os.path.join(gdir, entry)
-            if not os.path.exists(ep):
+            if "/" in entry or os.sep in entry or entry in (".", ".."):
+                found = os.path.exists(os.path.join(gdir, entry))
+            else:
+                found = entry in names
+            if not found:
                 missing_files.append(entry)
     if missing_files:
         return False, "ENTRY_NOT_FOUND", {"missing_files": missing_files}
     return True, "OK", {"config": cfg}
 
 
+# 開發者反覆登入時不必重算同一組密碼的雜湊
+@functools.lru_cache(maxsize=1024)
 def sha256_hex(s: str) -> str:
     return hashlib.sha256(s.encode("utf-8")).hexdigest()
 
 
+# \w 就是 str.isalnum() 加上底線；其他字元逐一換成 "-"，整段交給 C 層的 regex 一次掃完
+_NON_SLUG = re.compile(r"[^\w-]")
+
+
 def slugify(name: str) -> str:
-    out = []
-    for ch in name.lower():
-        if ch.isalnum() or ch in "-_":
-            out.append(ch)
-        else:
-            out.append("-")
-    slug = "".join(out).strip("-")
+    slug = _NON_SLUG.sub("-", name.lower()).strip("-")
     return slug or "game"
 
 
 class StoreDB:
-    """Very small JSON-backed store for developers, games, and ratings."""
+    """Very small JSON-backed store for developers, games, and ratings.
+
+    每次修改只記下變動的 (section, key)，由背景執行緒把那幾筆 append 到 journal
+    （common/journal），不再整份重寫。
+    """
 
     def __init__(self, db_path: str, storage_root: str):
         self.db_path = db_path
@@ -73,27 +119,73 @@ class StoreDB:
         self.lock = threading.RLock()
         # runtime-only session tokens to避免重複登入，同帳號僅允許最後一次登入有效
         self.active_dev_sessions: dict[str, str] = {}
-        if os.path.exists(db_path):
-            with open(db_path, "r", encoding="utf-8") as f:
-                self.db = json.load(f)
-        else:
-            self.db = {
-                "developers": {},  # user -> {passwordHash, createdAt}
-                "games": {},       # game_id -> {...}
-                "player_downloads": {},  # player -> {game_id: version}
-            }
-            self._flush()
+        self.journal = Journal(db_path)
+        self.db = self.journal.load({
+            "developers": {},  # user -> {passwordHash, createdAt}
+            "games": {},       # game_id -> {...}
+            "player_downloads": {},  # player -> {game_id: version}
+        })
+        if not os.path.exists(db_path):
+            self.journal.compact(self.db)
+        # (game_id, version) -> 解析好的 game_config.json；
+        # 版本目錄只在 dev_upload 通過檢查後寫入一次，寫入時一併更新這裡
+        self._configs: dict[tuple[str, str], dict] = {}
+        # author -> [game_id]（依建立順序）；dev_list 只看自己的遊戲，不必掃全部
+        self._by_author: dict[str, list[str]] = {}
+        # game_id -> {version: 版本紀錄}；指向 versions 串列裡同一個 dict。
+        # 舊資料若有重複版本號，沿用原本線性搜尋「先找到的優先」
+        self._versions: dict[str, dict[str, dict]] = {}
+        for gid, g in self.db["games"].items():
+            self._by_author.setdefault(g.get("author", ""), []).append(gid)
+            self._versions[gid] = {v.get("version"): v for v in reversed(g.get("versions", []))}
+        # 舊資料沒有評分彙總欄位，載入時從 ratings 補算一次
+        for g in self.db["games"].values():
+            if "ratingSum" not in g:
+                ratings = g.get("ratings") or []
+                g["ratingSum"] = sum(r["score"] for r in ratings)
+                g["ratingCount"] = len(ratings)
+        self._dirty = threading.Event()
+        self._dirty_keys: set[tuple[str, str]] = set()
+        self._write_lock = threading.Lock()
+        threading.Thread(target=self._writer_loop, daemon=True).start()
 
     # ---------------------- persistence helpers ----------------------
-    def _flush(self):
-        tmp = self.db_path + ".tmp"
-        with open(tmp, "w", encoding="utf-8") as f:
-            json.dump(self.db, f, ensure_ascii=False, indent=2)
-        os.replace(tmp, self.db_path)
+    def _persist(self, *keys: tuple[str, str]):
+        """標記 (section, key) 需要寫出；caller holds self.lock."""
+        self._dirty_keys.update(keys)
+        self._dirty.set()
 
-    def _save(self):
+    def _writer_loop(self):
+        while True:
+            self._dirty.wait()
+            time.sleep(FLUSH_DEBOUNCE)
+            self._dirty.clear()
+            try:
+                self._flush()
+            except OSError as exc:
+                print(f"[STORE] 寫入 {self.db_path} 失敗: {exc}")
+
+    def _flush(self):
+        with self._write_lock:
+            # 鎖內只複製變動過的那幾筆，序列化與寫檔都在鎖外
+            with self.lock:
+                keys, self._dirty_keys = self._dirty_keys, set()
+                records = [(section, key, copy.deepcopy(self.db[section].get(key))) for section, key in keys]
+            self.journal.append(records)
+            if self.journal.should_compact():
+                self._compact()
+
+    def _compact(self):
         with self.lock:
-            self._flush()
+            snap = copy.deepcopy(self.db)
+        self.journal.compact(snap)
+
+    def save(self):
+        """同步寫出尚未落地的修改並壓實成 snapshot（關閉伺服器前呼叫）。"""
+        self._dirty.clear()
+        self._flush()
+        with self._write_lock:
+            self._compact()
 
     # ---------------------- developer accounts -----------------------
     def register_dev(self, user: str, password: str):
@@ -104,7 +196,7 @@ class StoreDB:
                 "passwordHash": sha256_hex(password),
                 "createdAt": int(time.time()),
             }
-            self._flush()
+            self._persist(("developers", user))
             return True, "REGISTERED"
 
     def login_dev(self, user: str, password: str):
@@ -119,7 +211,8 @@ class StoreDB:
     # ---------------------- session helpers -------------------------
     def new_dev_session(self, user: str) -> tuple[str, bool]:
         """Create a new session token; returns (token, replaced_existing)."""
-        token = f"{time.time_ns()}-{os.getpid()}-{threading.get_ident()}"
+        # 不可預測的隨機 token，避免被猜出別人的 session
+        token = secrets.token_urlsafe(16)
         with self.lock:
             replaced = user in self.active_dev_sessions
             self.active_dev_sessions[user] = token
@@ -139,12 +232,29 @@ class StoreDB:
                 self.active_dev_sessions.pop(user, None)
 
     # ---------------------- game helpers -----------------------------
+    def add_game(self, gid: str, gdoc: dict):
+        """Caller holds self.lock."""
+        self.db["games"][gid] = gdoc
+        self._by_author.setdefault(gdoc.get("author", ""), []).append(gid)
+
+    def add_version(self, gid: str, record: dict):
+        """Caller holds self.lock."""
+        self.db["games"][gid].setdefault("versions", []).append(record)
+        self._versions.setdefault(gid, {})[record["version"]] = record
+
+    def find_version(self, gid: str, version: str) -> dict | None:
+        """Caller holds self.lock."""
+        return self._versions.get(gid, {}).get(version)
+
     def list_games(self, author: str | None = None, include_removed=False, include_versions=False):
         with self.lock:
             items = []
-            for gid, g in self.db["games"].items():
-                if author and g.get("author") != author:
-                    continue
+            games = self.db["games"]
+            if author:
+                pairs = ((gid, games[gid]) for gid in self._by_author.get(author, ()))
+            else:
+                pairs = games.items()
+            for gid, g in pairs:
                 if g.get("removed") and not include_removed:
                     continue
                 item = self._public_game_info(gid, g)
@@ -153,11 +263,22 @@ class StoreDB:
                 items.append(item)
             return items
 
+    def game_detail(self, gid: str, max_ratings: int | None = None) -> dict | None:
+        with self.lock:
+            g = self.db["games"].get(gid)
+            if not g or g.get("removed"):
+                return None
+            detail = dict(self._public_game_info(gid, g))
+            detail["versions"] = g.get("versions", [])
+            detail["ratings"] = g.get("ratings", [])[:max_ratings]
+            return detail
+
     def _public_game_info(self, gid: str, gdoc: dict) -> dict:
         versions = gdoc.get("versions") or []
         latest = gdoc.get("latestVersion") or (versions[-1]["version"] if versions else "")
-        ratings = gdoc.get("ratings") or []
-        avg = round(sum(r["score"] for r in ratings) / len(ratings), 2) if ratings else 0
+        # 評分總和與筆數在 record_rating 時累加，列表不必每次掃過所有評論
+        count = gdoc.get("ratingCount", 0)
+        avg = round(gdoc.get("ratingSum", 0) / count, 2) if count else 0
         return {
             "id": gid,
             "name": gdoc.get("name", gid),
@@ -169,14 +290,49 @@ class StoreDB:
             "versionCount": len(versions),
             "removed": gdoc.get("removed", False),
             "ratingAvg": avg,
-            "ratingCount": len(ratings),
+            "ratingCount": count,
             "downloadCount": gdoc.get("downloadCount", 0),
         }
 
-    def ensure_game_dir(self, gid: str, version: str):
-        gdir = os.path.abspath(os.path.join(self.storage_root, gid, version))
-        os.makedirs(gdir, exist_ok=True)
-        return gdir
+    def remember_config(self, gid: str, version: str, cfg: dict):
+        with self.lock:
+            self._configs[(gid, version)] = cfg
+
+    def game_config(self, gid: str, version: str, path: str) -> dict:
+        """啟動資訊用的 game_config；只有沒快取過的舊版本才讀磁碟。"""
+        with self.lock:
+            cfg = self._configs.get((gid, version))
+        if cfg is not None:
+            return cfg
+        cfg = {}
+        cfg_path = os.path.join(path, "game_config.json")
+        if os.path.exists(cfg_path):
+            try:
+                with open(cfg_path, "r", encoding="utf-8") as f:
+                    cfg = json.load(f)
+            except Exception:
+                cfg = {}
+        with self.lock:
+            self._configs[(gid, version)] = cfg
+        return cfg
+
+    def version_paths(self, gid: str, version: str) -> tuple[str, str]:
+        """版本目錄與壓縮檔的絕對路徑；只建立上層的遊戲目錄，版本目錄等上傳通過檢查才放進來。"""
+        game_dir = os.path.abspath(os.path.join(self.storage_root, gid))
+        os.makedirs(game_dir, exist_ok=True)
+        return os.path.join(game_dir, version), os.path.join(game_dir, f"{version}.zip")
+
+    def upload_conflict(self, gid: str, version: str, user: str) -> str | None:
+        """user 不能上傳 gid/version 時回傳錯誤碼（NOT_OWNER / VERSION_EXISTS），可以則回 None。"""
+        with self.lock:
+            g = self.db["games"].get(gid)
+            if g is None:
+                return None
+            if g.get("author") != user:
+                return "NOT_OWNER"
+            if self.find_version(gid, version) is not None:
+                return "VERSION_EXISTS"
+        return None
 
     def record_rating(self, player: str, gid: str, score: int, comment: str):
         with self.lock:
@@ -194,7 +350,9 @@ class StoreDB:
                 "comment": comment,
                 "at": int(time.time()),
             })
-            self._flush()
+            g["ratingSum"] = g.get("ratingSum", 0) + score
+            g["ratingCount"] = g.get("ratingCount", 0) + 1
+            self._persist(("games", gid))
             return True, "RATED"
 
     def record_download(self, player: str, gid: str, version: str):
@@ -202,9 +360,11 @@ class StoreDB:
             dl = self.db["player_downloads"].setdefault(player, {})
             dl[gid] = version
             g = self.db["games"].get(gid)
+            changed = [("player_downloads", player)]
             if g:
                 g["downloadCount"] = g.get("downloadCount", 0) + 1
-            self._flush()
+                changed.append(("games", gid))
+            self._persist(*changed)
 
 
 class StoreSession(threading.Thread):
@@ -224,6 +384,9 @@ class StoreSession(threading.Thread):
         except OSError:
             # Client already closed; stop sending to avoid BrokenPipe stack traces
             return False
+        except ValueError:
+            # 回應超過單一 frame 上限；仍回一個 frame，讓 client 的一問一答保持對齊
+            return self.send({"ok": False, "code": "RESPONSE_TOO_LARGE"})
 
     def require_dev_session(self) -> bool:
         """Validate developer login + active session token (防止重複登入)."""
@@ -280,7 +443,7 @@ class StoreSession(threading.Thread):
                         if g.get("author") != self.dev_user:
                             self.send({"ok": False, "code": "NOT_OWNER"}); continue
                         g["removed"] = True
-                        self.db._flush()
+                        self.db._persist(("games", gid))
                         self.send({"ok": True, "code": "REMOVED"})
                 elif op == "dev_upload":
                     if not self.require_dev_session():
@@ -294,86 +457,119 @@ class StoreSession(threading.Thread):
                         max_players = int(req.get("max_players", 2))
                     except (TypeError, ValueError):
                         self.send({"ok": False, "code": "BAD_FIELD", "field": "max_players"}); continue
-                    archive_b64 = req.get("archive_b64")
-                    if not archive_b64:
+                    archive_size = req.get("archive_size")
+                    if not archive_size:
                         self.send({"ok": False, "code": "NO_ARCHIVE"}); continue
-
                     try:
-                        blob = base64.b64decode(archive_b64.encode("utf-8"))
-                    except Exception:
-                        self.send({"ok": False, "code": "BAD_ARCHIVE"}); continue
-
-                    # persist archive
-                    gdir = self.db.ensure_game_dir(gid, version)
-                    zip_path = os.path.abspath(os.path.join(self.db.storage_root, gid, f"{version}.zip"))
-                    with open(zip_path, "wb") as f:
-                        f.write(blob)
-                    # extract to version dir
+                        archive_size = int(archive_size)
+                    except (TypeError, ValueError):
+                        self.send({"ok": False, "code": "BAD_FIELD", "field": "archive_size"}); continue
+                    # 壓縮檔本身也有上限；收檔時超過宣告大小就停，不讓 client 無限寫進磁碟
+                    if archive_size < 0 or archive_size > BUNDLE_MAX_BYTES:
+                        self.send({"ok": False, "code": "ARCHIVE_TOO_LARGE"}); continue
+                    # 擁有者與版本號先檢查，被拒絕的上傳不會碰到既有版本的檔案
+                    conflict = self.db.upload_conflict(gid, version, self.dev_user)
+                    if conflict:
+                        self.send({"ok": False, "code": conflict}); continue
+                    # 分塊上傳：先收到暫存目錄、解壓檢查，全部通過才換成正式的版本目錄
+                    gdir, zip_path = self.db.version_paths(gid, version)
+                    stage = tempfile.mkdtemp(prefix=f".{version}-", dir=os.path.dirname(gdir))
+                    stage_zip = os.path.join(stage, "archive.zip")
+                    stage_dir = os.path.join(stage, "bundle")
                     try:
-                        shutil.unpack_archive(zip_path, gdir)
-                    except Exception:
-                        self.send({"ok": False, "code": "UNPACK_FAIL"}); continue
-                    valid, vcode, vdetail = validate_game_bundle(gdir)
-                    if not valid:
-                        # 清掉無效上傳，避免留下半套資料
-                        try:
-                            shutil.rmtree(gdir, ignore_errors=True)
-                            os.remove(zip_path)
-                        except OSError:
-                            pass
-                        payload = {"ok": False, "code": vcode}
-                        payload.update(vdetail)
-                        self.send(payload)
-                        continue
-                    cfg = vdetail.get("config", {})
-                    raw_name = raw_name or cfg.get("name", gid)
-                    desc = desc or cfg.get("description", "")
-                    game_type = game_type or cfg.get("type", "cli")
-                    if not max_players:
+                        if not self.send({"ok": True, "code": "SEND_ARCHIVE"}):
+                            break
+                        digest = hashlib.sha256()
+                        with open(stage_zip, "wb") as f:
+                            try:
+                                got = recv_chunks(self.s, f, "dev_upload_chunk", digest, limit=archive_size)
+                            except ValueError:
+                                got = -1  # 收齊了但 sha256 不符
+                        if got != archive_size:
+                            if got is None:
+                                break  # 串流中斷或順序錯亂，無法再對齊 frame
+                            if got > archive_size:
+                                # 超過宣告大小就停收，剩下的 chunk 沒讀，連線也一併結束
+                                self.send({"ok": False, "code": "ARCHIVE_TOO_LARGE"})
+                                break
+                            self.send({"ok": False, "code": "BAD_ARCHIVE"}); continue
+                        # extract to staging dir（先檢查路徑與大小，再一次解壓）
                         try:
-                            max_players = int(cfg.get("max_players", 2))
+                            with zipfile.ZipFile(stage_zip) as zf:
+                                bad = check_bundle_zip(zf)
+                                if not bad:
+                                    zf.extractall(stage_dir)
                         except Exception:
-                            max_players = 2
-                    if max_players < 1:
-                        self.send({"ok": False, "code": "BAD_FIELD", "field": "max_players"}); continue
-
-                    with self.db.lock:
-                        games = self.db.db["games"]
-                        gdoc = games.get(gid)
-                        now = int(time.time())
-                        if not gdoc:
-                            gdoc = {
-                                "id": gid,
-                                "name": raw_name or gid,
-                                "author": self.dev_user,
-                                "description": desc,
-                                "gameType": game_type,
-                                "maxPlayers": max_players,
-                                "versions": [],
-                                "latestVersion": version,
-                                "removed": False,
-                                "ratings": [],
-                                "downloadCount": 0,
-                            }
-                            games[gid] = gdoc
+                            bad = "UNPACK_FAIL"
+                        if bad:
+                            valid, vcode, vdetail = False, bad, {}
                         else:
-                            if gdoc.get("author") != self.dev_user:
-                                self.send({"ok": False, "code": "NOT_OWNER"}); continue
-                            if any(v.get("version") == version for v in gdoc.get("versions", [])):
-                                self.send({"ok": False, "code": "VERSION_EXISTS"}); continue
-                            gdoc["name"] = raw_name or gdoc.get("name", gid)
-                            gdoc["description"] = desc or gdoc.get("description", "")
-                            gdoc["gameType"] = game_type or gdoc.get("gameType", "cli")
-                            gdoc["maxPlayers"] = max_players or gdoc.get("maxPlayers", 2)
-                            gdoc["removed"] = False
-                            gdoc["latestVersion"] = version
-                        gdoc.setdefault("versions", []).append({
-                            "version": version,
-                            "path": gdir,
-                            "zip": zip_path,
-                            "uploadedAt": now,
-                        })
-                        self.db._flush()
+                            valid, vcode, vdetail = validate_game_bundle(stage_dir)
+                        if not valid:
+                            payload = {"ok": False, "code": vcode}
+                            payload.update(vdetail)
+                            self.send(payload)
+                            continue
+                        cfg = vdetail.get("config", {})
+                        raw_name = raw_name or cfg.get("name", gid)
+                        desc = desc or cfg.get("description", "")
+                        game_type = game_type or cfg.get("type", "cli")
+                        if not max_players:
+                            try:
+                                max_players = int(cfg.get("max_players", 2))
+                            except Exception:
+                                max_players = 2
+                        if max_players < 1:
+                            self.send({"ok": False, "code": "BAD_FIELD", "field": "max_players"}); continue
+
+                        with self.db.lock:
+                            # 收檔期間可能有人搶先上傳同一版本，換目錄前在鎖內再確認一次
+                            conflict = self.db.upload_conflict(gid, version, self.dev_user)
+                            if conflict:
+                                self.send({"ok": False, "code": conflict}); continue
+                            # 沒有版本紀錄的同名目錄只會是先前中斷留下的殘檔
+                            shutil.rmtree(gdir, ignore_errors=True)
+                            os.replace(stage_dir, gdir)
+                            os.replace(stage_zip, zip_path)
+                            # 版本目錄只在這裡寫入，快取跟著同一把鎖換成新的設定
+                            self.db.remember_config(gid, version, cfg)
+                            games = self.db.db["games"]
+                            gdoc = games.get(gid)
+                            now = int(time.time())
+                            if not gdoc:
+                                gdoc = {
+                                    "id": gid,
+                                    "name": raw_name or gid,
+                                    "author": self.dev_user,
+                                    "description": desc,
+                                    "gameType": game_type,
+                                    "maxPlayers": max_players,
+                                    "versions": [],
+                                    "latestVersion": version,
+                                    "removed": False,
+                                    "ratings": [],
+                                    "ratingSum": 0,
+                                    "ratingCount": 0,
+                                    "downloadCount": 0,
+                                }
+                                self.db.add_game(gid, gdoc)
+                            else:
+                                gdoc["name"] = raw_name or gdoc.get("name", gid)
+                                gdoc["description"] = desc or gdoc.get("description", "")
+                                gdoc["gameType"] = game_type or gdoc.get("gameType", "cli")
+                                gdoc["maxPlayers"] = max_players or gdoc.get("maxPlayers", 2)
+                                gdoc["removed"] = False
+                                gdoc["latestVersion"] = version
+                            self.db.add_version(gid, {
+                                "version": version,
+                                "path": gdir,
+                                "zip": zip_path,
+                                "sha256": digest.hexdigest(),
+                                "uploadedAt": now,
+                            })
+                            self.db._persist(("games", gid))
+                    finally:
+                        shutil.rmtree(stage, ignore_errors=True)
                     self.send({"ok": True, "code": "UPLOADED", "game_id": gid, "version": version})
                 elif op == "list_games":
                     games = self.db.list_games(author=None, include_removed=False)
@@ -382,14 +578,27 @@ class StoreSession(threading.Thread):
                     gid = req.get("game_id")
                     if not gid:
                         self.send({"ok": False, "code": "BAD_FIELD"}); continue
-                    with self.db.lock:
-                        g = self.db.db["games"].get(gid)
-                        if not g or g.get("removed"):
-                            self.send({"ok": False, "code": "NO_SUCH_GAME"}); continue
-                        detail = dict(self.db._public_game_info(gid, g))
-                        detail["versions"] = g.get("versions", [])
-                        detail["ratings"] = g.get("ratings", [])
+                    detail = self.db.game_detail(gid)
+                    if detail is None:
+                        self.send({"ok": False, "code": "NO_SUCH_GAME"}); continue
                     self.send({"ok": True, "code": "GAME", "game": detail})
+                elif op == "game_details_batch":
+                    # 玩家端瀏覽列表時預先抓前幾款的詳細資料，一個 frame 回傳
+                    gids = req.get("game_ids")
+                    if not isinstance(gids, list):
+                        self.send({"ok": False, "code": "BAD_FIELD"}); continue
+                    games = {}
+                    budget = DETAILS_BATCH_BYTES
+                    for gid in gids[:DETAILS_BATCH_MAX]:
+                        detail = self.db.game_detail(gid, max_ratings=DETAILS_BATCH_RATINGS)
+                        if detail is None:
+                            continue
+                        # 放不下就停，沒帶到的遊戲玩家端會照常單獨查詢
+                        budget -= len(json.dumps(detail, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+                        if budget < 0:
+                            break
+                        games[gid] = detail
+                    self.send({"ok": True, "code": "GAMES_DETAIL", "games": games})
                 elif op == "download_game":
                     gid = req.get("game_id")
                     version = req.get("version")
@@ -405,26 +614,31 @@ class StoreSession(threading.Thread):
                             self.send({"ok": False, "code": "NO_VERSION"}); continue
                         if not version:
                             version = g.get("latestVersion") or versions[-1]["version"]
-                        target = None
-                        for v in versions:
-                            if v.get("version") == version:
-                                target = v; break
+                        target = self.db.find_version(gid, version)
                         if not target:
                             self.send({"ok": False, "code": "NO_SUCH_VERSION"}); continue
                         zip_path = target.get("zip")
+                        zip_sha = target.get("sha256")
+                    # 先回 JSON header（含大小），再以 chunk frame 直接從檔案串流原始 bytes
                     try:
-                        with open(zip_path, "rb") as f:
-                            blob = f.read()
+                        f = open(zip_path, "rb")
                     except OSError:
                         self.send({"ok": False, "code": "FILE_MISSING"}); continue
-                    self.db.record_download(player, gid, version)
-                    self.send({
-                        "ok": True,
-                        "code": "DOWNLOAD",
-                        "game_id": gid,
-                        "version": version,
-                        "archive_b64": base64.b64encode(blob).decode("utf-8"),
-                    })
+                    with f:
+                        self.db.record_download(player, gid, version)
+                        if not self.send({
+                            "ok": True,
+                            "code": "DOWNLOAD",
+                            "game_id": gid,
+                            "version": version,
+                            "archive_size": os.fstat(f.fileno()).st_size,
+                        }):
+                            break
+                        try:
+                            # 上傳時已記下 sha256 的版本走 sendfile，不必讀進記憶體再算一次
+                            send_chunks(self.s, f, "download_chunk", sha256=zip_sha)
+                        except OSError:
+                            break
                 elif op == "record_rating":
                     gid = req.get("game_id")
                     player = req.get("player", "")
@@ -446,21 +660,11 @@ class StoreSession(threading.Thread):
                             self.send({"ok": False, "code": "NO_VERSION"}); continue
                         if not version:
                             version = g.get("latestVersion") or versions[-1]["version"]
-                        target = None
-                        for v in versions:
-                            if v.get("version") == version:
-                                target = v; break
+                        target = self.db.find_version(gid, version)
                         if not target:
                             self.send({"ok": False, "code": "NO_SUCH_VERSION"}); continue
                         path = os.path.abspath(target.get("path", ""))
-                        cfg_path = os.path.join(path, "game_config.json")
-                        cfg = {}
-                        if os.path.exists(cfg_path):
-                            try:
-                                with open(cfg_path, "r", encoding="utf-8") as f:
-                                    cfg = json.load(f)
-                            except Exception:
-                                cfg = {}
+                        cfg = self.db.game_config(gid, version, path)
                         info = {
                             "game_id": gid,
                             "version": version,
@@ -490,12 +694,24 @@ def serve(host: str, port: int, db_path: str, storage_root: str):
     db = StoreDB(db_path, storage_root)
     print(f"[STORE] listening on {host}:{port}, storage={storage_root}, db={db_path}")
     import socket
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as srv:
-        srv.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        srv.bind((host, port)); srv.listen(128)
-        while True:
-            c, a = srv.accept()
-            StoreSession(c, a, db).start()
+    # SIGTERM 也走正常結束流程，讓 finally 把背景還沒寫的修改落地
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as srv:
+            srv.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            # 上傳/下載都是整包 zip；接收緩衝在 listen 前設定才會套用到 accept 的連線
+            srv.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, BULK_SOCK_BUF)
+            srv.bind((host, port)); srv.listen(128)
+            while True:
+                c, a = srv.accept()
+                # 小的 JSON 回覆不要被 Nagle 延遲；大塊的 zip 靠放大的送出緩衝
+                c.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                c.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, BULK_SOCK_BUF)
+                StoreSession(c, a, db).start()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        db.save()
 
 
 if __name__ == "__main__":
@@ -5,26 +5,60 @@ import json
 import socket
 import sys
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# 有 orjson 就用（直接輸出 UTF-8 bytes）；import 時就決定實作，熱路徑上不再每次判斷
+if orjson is not None:
+    _dumps = orjson.dumps
+    _loads = orjson.loads
+else:
+    _encode = json.JSONEncoder(separators=(",", ":")).encode
+
+    def _dumps(obj) -> bytes:
+        return _encode(obj).encode("utf-8")
+
+    def _loads(data) -> dict:
+        return json.loads(data)
+
 
 def send_json(sock: socket.socket, obj: dict):
-    data = json.dumps(obj).encode("utf-8")
+    data = _dumps(obj)
     hdr = len(data).to_bytes(4, "big")
     sock.sendall(hdr + data)
 
 
+# MSG_WAITALL 讓核心一次收滿；只有被訊號打斷或連線關閉時才會回到迴圈補收
+_WAITALL = getattr(socket, "MSG_WAITALL", 0)
+
+
+def _recvn(sock: socket.socket, n: int):
+    # 預先配置好整個 frame，recv_into 直接寫入，避免 bytes 反覆串接
+    buf = bytearray(n)
+    mv = memoryview(buf)
+    got = 0
+    while got < n:
+        k = sock.recv_into(mv[got:], n - got, _WAITALL)
+        if not k:
+            return None
+        got += k
+    return buf
+
+
 def recv_json(sock: socket.socket) -> dict | None:
-    hdr = sock.recv(4)
-    if not hdr:
+    hdr = _recvn(sock, 4)
+    if hdr is None:
         return None
     n = int.from_bytes(hdr, "big")
-    body = b""
-    while len(body) < n:
-        chunk = sock.recv(n - len(body))
-        if not chunk:
-            return None
-        body += chunk
+    body = _recvn(sock, n)
+    if body is None:
+        return None
     try:
-        return json.loads(body.decode("utf-8"))
+        # 直接從 bytearray 解析（自動判斷 UTF-8），不必先 decode 成 str 多複製一次
+        return _loads(body)
     except Exception:
         return None
 
@@ -37,6 +71,7 @@ def main():
     args = ap.parse_args()
 
     with socket.create_connection((args.host, args.port)) as s:
+        s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
         send_json(s, {"op": "hello", "user": args.user})
         print(f"已連線到遊戲 {args.host}:{args.port}，玩家 {args.user}")
         while True:
@@ -2,31 +2,66 @@
 """Simple number guessing duel game server."""
 import argparse
 import json
+import queue
 import random
 import socket
 import threading
 import time
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# 有 orjson 就用（直接輸出 UTF-8 bytes）；import 時就決定實作，熱路徑上不再每次判斷
+if orjson is not None:
+    _dumps = orjson.dumps
+    _loads = orjson.loads
+else:
+    _encode = json.JSONEncoder(separators=(",", ":")).encode
+
+    def _dumps(obj) -> bytes:
+        return _encode(obj).encode("utf-8")
+
+    def _loads(data) -> dict:
+        return json.loads(data)
+
 
 def send_json(sock: socket.socket, obj: dict):
-    data = json.dumps(obj).encode("utf-8")
+    data = _dumps(obj)
     hdr = len(data).to_bytes(4, "big")
     sock.sendall(hdr + data)
 
 
+# MSG_WAITALL 讓核心一次收滿；只有被訊號打斷或連線關閉時才會回到迴圈補收
+_WAITALL = getattr(socket, "MSG_WAITALL", 0)
+
+
+def _recvn(sock: socket.socket, n: int):
+    # 預先配置好整個 frame，recv_into 直接寫入，避免 bytes 反覆串接
+    buf = bytearray(n)
+    mv = memoryview(buf)
+    got = 0
+    while got < n:
+        k = sock.recv_into(mv[got:], n - got, _WAITALL)
+        if not k:
+            return None
+        got += k
+    return buf
+
+
 def recv_json(sock: socket.socket) -> dict | None:
-    hdr = sock.recv(4)
-    if not hdr:
+    hdr = _recvn(sock, 4)
+    if hdr is None:
         return None
     n = int.from_bytes(hdr, "big")
-    body = b""
-    while len(body) < n:
-        chunk = sock.recv(n - len(body))
-        if not chunk:
-            return None
-        body += chunk
+    body = _recvn(sock, n)
+    if body is None:
+        return None
     try:
-        return json.loads(body.decode("utf-8"))
+        # 直接從 bytearray 解析（自動判斷 UTF-8），不必先 decode 成 str 多複製一次
+        return _loads(body)
     except Exception:
         return None
 
@@ -37,8 +72,7 @@ class PlayerConn(threading.Thread):
         self.s = sock
         self.a = addr
         self.user = None
-        self.inbox = []
-        self.lock = threading.RLock()
+        self.inbox = queue.Queue()
 
     def send(self, obj: dict):
         try:
@@ -57,8 +91,7 @@ class PlayerConn(threading.Thread):
                 data = recv_json(self.s)
                 if not data:
                     break
-                with self.lock:
-                    self.inbox.append(data)
+                self.inbox.put(data)
         finally:
             try:
                 self.s.close()
@@ -66,13 +99,11 @@ class PlayerConn(threading.Thread):
                 pass
 
     def pop_msg(self, timeout=10.0):
-        deadline = time.time() + timeout
-        while time.time() < deadline:
-            with self.lock:
-                if self.inbox:
-                    return self.inbox.pop(0)
-            time.sleep(0.1)
-        return None
+        # 阻塞等待，訊息一到立即喚醒，不再定時輪詢
+        try:
+            return self.inbox.get(timeout=timeout)
+        except queue.Empty:
+            return None
 
 
 def main():
@@ -98,6 +129,8 @@ def main():
                 c, a = srv.accept()
             except socket.timeout:
                 continue
+            # 回合訊息很小，不要讓 Nagle 延遲送出
+            c.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
             p = PlayerConn(c, a)
             p.start()
             clients.append(p)
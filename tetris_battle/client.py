@@ -2,8 +2,12 @@
 # -*- coding: utf-8 -*-
 """Tetris Battle pygame client for HW3 (2P)."""
 import argparse, pygame, socket, threading, time, json
-from proto import rle_decode_rowmajor, BOARD_W, BOARD_H
-from ui_fx import draw_header, draw_block_cell, FlashOverlay, ScreenShake, Confetti
+try:
+    import orjson
+except ImportError:
+    orjson = None
+from proto import rle_decode_rowmajor, rle_decode_into, BOARD_W, BOARD_H
+from ui_fx import draw_header, draw_block_cell, render_text, FlashOverlay, ScreenShake, Confetti
 
 # --- rendering helpers ---
 SHAPE_COLOR = {"I":1,"O":2,"T":3,"S":4,"Z":5,"J":6,"L":7}
@@ -20,17 +24,54 @@ _SHAPE_MASKS = {
 }
 def _rot_cw(mask):
     return [[mask[3-x][y] for x in range(4)] for y in range(4)]
-def _shape_mask(shape, rot):
-    m = _SHAPE_MASKS.get(shape, [[0]*4 for _ in range(4)])
-    for _ in range((rot or 0) % 4):
-        m = _rot_cw(m)
-    return m
+def _rotations(mask):
+    rots = []
+    for _ in range(4):
+        rots.append(mask)
+        mask = _rot_cw(mask)
+    return rots
+# 每個旋轉壓成 16-bit 遮罩（bit yy*4+xx），填滿格與外框都由遮罩在啟動時推得
+_MASK_BITS = {
+    shape: tuple(sum(m[yy][xx] << (yy*4 + xx) for yy in range(4) for xx in range(4))
+                 for m in _rotations(base))
+    for shape, base in _SHAPE_MASKS.items()
+}
+def _bit_cells(bits):
+    cells = []
+    while bits:
+        lsb = bits & -bits
+        cells.append(divmod(lsb.bit_length() - 1, 4))  # (yy, xx)
+        bits ^= lsb
+    return tuple(cells)
+def _piece_entry(bits):
+    cells = _bit_cells(bits)
+    xs = [xx for _, xx in cells]
+    ys = [yy for yy, _ in cells]
+    return cells, (min(xs), max(xs), min(ys), max(ys))
+# shape -> 4 個旋轉的 (填滿格, (min_xx, max_xx, min_yy, max_yy))
+_PIECES = {shape: tuple(_piece_entry(b) for b in rots) for shape, rots in _MASK_BITS.items()}
+def _shape_piece(shape, rot):
+    rots = _PIECES.get(shape)
+    return rots[(rot or 0) % 4] if rots else None
 
 
 # ---------- Game connection ----------
+CONNECT_TIMEOUT = 0.5
+
+
 def _connect(host, port):
     s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    s.connect((host, port))
+    # 連線逾時要短，重試間隔由逾時本身決定；連上後恢復 blocking 給 RX thread 使用
+    s.settimeout(CONNECT_TIMEOUT)
+    try:
+        s.connect((host, port))
+    except OSError:
+        s.close()
+        raise
+    s.settimeout(None)
+    # INPUT frames are tiny and bursty; don't let Nagle hold them back.
+    s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    s.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
     return s
 
 
@@ -46,32 +87,72 @@ def connect_game(gh, gp, timeout_sec: float = 10.0):
                 raise RuntimeError(f"bad welcome: {welcome}")
             my_role = welcome.get("role", "P1")
             return g, my_role
+        except socket.timeout as e:
+            last_err = e
         except OSError as e:
+            # ECONNREFUSED 會立即返回，稍等 server 開始 listen
             last_err = e
             time.sleep(0.2)
     raise ConnectionError(f"cannot connect to game server {gh}:{gp}: {last_err}")
 
 
 # ---------- framing ----------
+# 與 server.py 相同：import 時就決定實作，熱路徑上不再每次判斷
+if orjson is not None:
+    _dumps = orjson.dumps
+    _loads = orjson.loads
+else:
+    _encode = json.JSONEncoder(separators=(",", ":")).encode
+
+    def _dumps(obj) -> bytes:
+        return _encode(obj).encode("utf-8")
+
+    def _loads(data: bytes):
+        return json.loads(data.decode("utf-8"))
+
+
 def send_json(sock: socket.socket, obj: dict):
-    data = json.dumps(obj).encode("utf-8")
+    data = _dumps(obj)
     hdr = len(data).to_bytes(4, "big")
     sock.sendall(hdr + data)
 
 
+def send_many(sock: socket.socket, objs):
+    bufs = []
+    for obj in objs:
+        data = _dumps(obj)
+        bufs.append(len(data).to_bytes(4, "big"))
+        bufs.append(data)
+    sock.sendall(b"".join(bufs))
+
+
+# MSG_WAITALL 讓核心一次收滿；只有被訊號打斷或連線關閉時才會回到迴圈補收
+_WAITALL = getattr(socket, "MSG_WAITALL", 0)
+
+
+def _recvn(sock: socket.socket, n: int):
+    # 預先配置好整個 frame，recv_into 直接寫入，避免 bytes 反覆串接
+    buf = bytearray(n)
+    mv = memoryview(buf)
+    got = 0
+    while got < n:
+        k = sock.recv_into(mv[got:], n - got, _WAITALL)
+        if not k:
+            return None
+        got += k
+    return buf
+
+
 def recv_json(sock: socket.socket):
-    hdr = sock.recv(4)
-    if not hdr:
+    hdr = _recvn(sock, 4)
+    if hdr is None:
         return None
     n = int.from_bytes(hdr, "big")
-    body = b""
-    while len(body) < n:
-        chunk = sock.recv(n - len(body))
-        if not chunk:
-            return None
-        body += chunk
+    body = _recvn(sock, n)
+    if body is None:
+        return None
     try:
-        return json.loads(body.decode("utf-8"))
+        return _loads(body)
     except Exception:
         return None
 
@@ -102,48 +183,94 @@ TEXT     = (230,230,230)
 TEXT_DIM = (190,190,190)
 RESULT_C = (255,220,160)
 
+# 每欄/每列相對棋盤原點的像素位移，繪圖時只需加上 ox/oy
+_DX = tuple(x*(CELL+GAP) for x in range(BOARD_W))
+_DY = tuple(y*(CELL+GAP) for y in range(BOARD_H))
+
+
+# 字型與固定標籤只建立一次（需在 pygame.init() 之後）
+_LABEL_FONT = None
+_SCORE_FONT = None
+_LABEL_SURFS = {}
+
+
+def _get_fonts():
+    global _LABEL_FONT, _SCORE_FONT
+    if _LABEL_FONT is None:
+        _LABEL_FONT = pygame.font.SysFont(None, 26)
+        _SCORE_FONT = pygame.font.SysFont(None, 22)
+    return _LABEL_FONT, _SCORE_FONT
+
+
+_GRID_BG = None
+
+
+def _grid_background():
+    """空棋盤的格線只畫一次到透明 Surface，每幀整張 blit。"""
+    global _GRID_BG
+    if _GRID_BG is None:
+        board_w_px = BOARD_W*(CELL+GAP) - GAP
+        board_h_px = BOARD_H*(CELL+GAP) - GAP
+        bg = pygame.Surface((board_w_px, board_h_px), pygame.SRCALPHA)
+        for y in range(BOARD_H):
+            for x in range(BOARD_W):
+                pygame.draw.rect(bg, GRID, (x*(CELL+GAP), y*(CELL+GAP), CELL, CELL), width=1, border_radius=4)
+        _GRID_BG = bg.convert_alpha()
+    return _GRID_BG
+
+
+def _label_surface(label):
+    surf = _LABEL_SURFS.get(label)
+    if surf is None:
+        surf = _LABEL_SURFS[label] = _get_fonts()[0].render(label, True, TEXT)
+    return surf
+
 
 def draw_grid(surface, ox, oy, grid, active=None, label="YOU", score=0):
     w, h = BOARD_W, BOARD_H
     board_w_px = BOARD_W*(CELL+GAP) - GAP
     board_h_px = BOARD_H*(CELL+GAP) - GAP
 
-    # 棋盤（已鎖定）
-    for y in range(h):
-        for x in range(w):
-            val = grid[y][x]
-            color = COLORS[val] if 0 <= val < len(COLORS) else COLORS[0]
-            rx = ox + x * (CELL + GAP)
-            ry = oy + y * (CELL + GAP)
-            if val:
-                draw_block_cell(surface, rx, ry, CELL, color)  # 霓虹格
-            else:
-                pygame.draw.rect(surface, GRID, (rx, ry, CELL, CELL), width=1, border_radius=4)
+    # 空格框線一次 blit，之後只畫已鎖定的方塊
+    surface.blit(_grid_background(), (ox, oy))
+    # 迴圈內用區域變數（LOAD_FAST）取代全域查找
+    dxs, dys = _DX, _DY
+    cell, colors, n_colors, draw_cell = CELL, COLORS, len(COLORS), draw_block_cell
+    for row, dy in zip(grid, dys):
+        ry = oy + dy
+        for val, dx in zip(row, dxs):
+            if not val:
+                continue
+            color = colors[val] if 0 <= val < n_colors else colors[0]
+            draw_cell(surface, ox + dx, ry, cell, color)  # 霓虹格
 
     # 疊加下落中的 active
-    if active and isinstance(active, dict) and active.get("shape"):
-        ax, ay = int(active.get("x", 0)), int(active.get("y", 0))
-        rot    = int(active.get("rot", 0))
-        shape  = active.get("shape", "T")
-        color_idx = int(active.get("color", SHAPE_COLOR.get(shape, 1)))
-        color = COLORS[color_idx] if 0 <= color_idx < len(COLORS) else COLORS[1]
-        mask = _shape_mask(shape, rot)
-        for yy in range(4):
-            for xx in range(4):
-                if not mask[yy][xx]:
-                    continue
-                gx, gy = ax + xx, ay + yy
-                if 0 <= gx < w and 0 <= gy < h:
-                    rx = ox + gx * (CELL + GAP)
-                    ry = oy + gy * (CELL + GAP)
-                    draw_block_cell(surface, rx, ry, CELL, color)
+    if active and isinstance(active, dict):
+        shape = active.get("shape")
+        if shape:
+            ax, ay = int(active.get("x", 0)), int(active.get("y", 0))
+            rot = int(active.get("rot", 0))
+            color_idx = active.get("color")
+            color_idx = SHAPE_COLOR.get(shape, 1) if color_idx is None else int(color_idx)
+            color = colors[color_idx] if 0 <= color_idx < n_colors else colors[1]
+            piece = _shape_piece(shape, rot)
+            if piece:
+                cells, (x0, x1, y0, y1) = piece
+                if 0 <= ax + x0 and ax + x1 < w and 0 <= ay + y0 and ay + y1 < h:
+                    # 整塊都在盤面內：省去逐格邊界檢查
+                    for yy, xx in cells:
+                        draw_cell(surface, ox + dxs[ax + xx], oy + dys[ay + yy], cell, color)
+                else:
+                    for yy, xx in cells:
+                        gx, gy = ax + xx, ay + yy
+                        if 0 <= gx < w and 0 <= gy < h:
+                            draw_cell(surface, ox + dxs[gx], oy + dys[gy], cell, color)
 
     # 下方兩行：YOU/RIVAL 與 score
-    label_font = pygame.font.SysFont(None, 26)
-    score_font = pygame.font.SysFont(None, 22)
-    surface.blit(label_font.render(label, True, TEXT),
+    _, score_font = _get_fonts()
+    surface.blit(_label_surface(label),
                  (ox, oy + board_w_px + (BOARD_H*(CELL+GAP)-GAP - board_w_px)))
-    surface.blit(score_font.render(f"score: {score}", True, TEXT_DIM),
+    surface.blit(render_text(score_font, f"score: {score}", TEXT_DIM),
                  (ox, oy + board_h_px + 30))
 
 
@@ -154,16 +281,27 @@ class ClientState:
     def __init__(self, my_role: str):
         self.my_role = my_role
         self.roles = ["P1", "P2"]
-        self.lock = threading.RLock()
+        # RX 在鎖內就地解碼盤面，UI 畫盤面時也持有；不會重入，用較輕的 Lock 即可
+        self.lock = threading.Lock()
         self.snap = {
             "P1": {"board": blank_grid(), "active": {"x":5,"y":0,"shape":"T","rot":0}, "score":0, "tick":0},
             "P2": {"board": blank_grid(), "active": {"x":5,"y":0,"shape":"T","rot":0}, "score":0, "tick":0},
         }
+        self.lines = {"P1": 0, "P2": 0}
+        # 每個 role 一張盤面重複使用，解碼與繪製都在 self.lock 內，不會畫到解到一半的盤面
+        self._boards = {r: blank_grid() for r in self.roles}
         self.result = None
 
-    def update_snap(self, role, snap):
+    def update_snap(self, role, snap, rle=""):
         with self.lock:
+            board = self._boards.get(role)
+            if board is None:
+                board = rle_decode_rowmajor(rle, BOARD_W, BOARD_H)
+            else:
+                rle_decode_into(rle, board)
+            snap["board"] = board
             self.snap[role] = snap
+            self.lines[role] = snap.get("lines", 0)
 
     def set_result(self, res):
         with self.lock:
@@ -180,16 +318,14 @@ def start_rx_thread(sock, state: ClientState):
                 break
             t = m.get("type")
             if t == "SNAPSHOT":
-                board = rle_decode_rowmajor(m.get("boardRLE", ""), BOARD_W, BOARD_H)
                 state.update_snap(m.get("role"), {
-                    "board": board,
                     "active": m.get("active"),
                     "hold": m.get("hold"),
                     "next": m.get("next", []),
                     "score": m.get("score", 0),
                     "lines": m.get("lines", 0),
                     "tick": m.get("tick", 0),
-                })
+                }, m.get("boardRLE", ""))
             elif t == "RESULT":
                 state.set_result(m)
                 stop_flag["stop"] = True
@@ -211,6 +347,8 @@ def run_ui(sock, state: ClientState, user_id: str):
 
     font_big = pygame.font.SysFont(None, 42)
     font_mid = pygame.font.SysFont(None, 24)
+    _get_fonts()
+    _grid_background()
     clock = pygame.time.Clock()
     shake = ScreenShake()
     confetti = Confetti()
@@ -221,6 +359,19 @@ def run_ui(sock, state: ClientState, user_id: str):
     peer_role = "P2" if me_role == "P1" else "P1"
 
     prev_lines = {me_role: 0, peer_role: 0}
+    lines = state.lines
+    blank = blank_grid()
+    empty_snap = {}
+
+    key_actions = {
+        pygame.K_LEFT: "LEFT",
+        pygame.K_RIGHT: "RIGHT",
+        pygame.K_UP: "ROT",
+        pygame.K_SPACE: "HARD",
+        pygame.K_DOWN: "SOFT",
+        pygame.K_c: "HOLD",
+    }
+    pending = []
 
     while True:
         for event in pygame.event.get():
@@ -229,18 +380,13 @@ def run_ui(sock, state: ClientState, user_id: str):
             if event.type == pygame.KEYDOWN:
                 if event.key == pygame.K_q:
                     return
-                elif event.key == pygame.K_LEFT:
-                    send_json(sock, {"type": "INPUT", "action": "LEFT", "seq": _next_seq()})
-                elif event.key == pygame.K_RIGHT:
-                    send_json(sock, {"type": "INPUT", "action": "RIGHT", "seq": _next_seq()})
-                elif event.key == pygame.K_UP:
-                    send_json(sock, {"type": "INPUT", "action": "ROT", "seq": _next_seq()})
-                elif event.key == pygame.K_SPACE:
-                    send_json(sock, {"type": "INPUT", "action": "HARD", "seq": _next_seq()})
-                elif event.key == pygame.K_DOWN:
-                    send_json(sock, {"type": "INPUT", "action": "SOFT", "seq": _next_seq()})
-                elif event.key == pygame.K_c:
-                    send_json(sock, {"type": "INPUT", "action": "HOLD", "seq": _next_seq()})
+                action = key_actions.get(event.key)
+                if action:
+                    pending.append({"type": "INPUT", "action": action, "seq": _next_seq()})
+        # 同一幀的按鍵合併成一次送出
+        if pending:
+            send_many(sock, pending)
+            pending.clear()
 
         offset = shake.offset()
         screen.fill(BG)
@@ -248,15 +394,17 @@ def run_ui(sock, state: ClientState, user_id: str):
         draw_header(screen, "Tetris Battle", f"玩家: {user_id}  角色: {me_role}",
                     pos=(PADDING + offset[0], PADDING + offset[1]))
 
-        me = state.snap.get(me_role, {})
-        peer = state.snap.get(peer_role, {})
+        snap = state.snap
+        me = snap.get(me_role) or empty_snap
+        peer = snap.get(peer_role) or empty_snap
 
         top_y = PADDING + HEADER_H + offset[1]
         left_x = PADDING + offset[0]
         right_x = PADDING + board_w_px + GUTTER_X + offset[0]
 
-        draw_grid(screen, left_x, top_y, me.get("board", blank_grid()), me.get("active"), "YOU", me.get("score", 0))
-        draw_grid(screen, right_x, top_y, peer.get("board", blank_grid()), peer.get("active"), "RIVAL", peer.get("score", 0))
+        with state.lock:
+            draw_grid(screen, left_x, top_y, me.get("board") or blank, me.get("active"), "YOU", me.get("score", 0))
+            draw_grid(screen, right_x, top_y, peer.get("board") or blank, peer.get("active"), "RIVAL", peer.get("score", 0))
 
         # 底部結果
         res = state.result
@@ -270,23 +418,25 @@ def run_ui(sock, state: ClientState, user_id: str):
                 txt = "Draw"
             else:
                 txt = f"You lose. {res.get('p1')} - {res.get('p2')}"
-            msg = font_big.render(txt, True, RESULT_C)
+            msg = render_text(font_big, txt, RESULT_C)
             screen.blit(msg, (result_rect.x + 12, result_rect.y))
-            hint = font_mid.render("Q 退出房間", True, TEXT_DIM)
+            hint = render_text(font_mid, "Q 退出房間", TEXT_DIM)
             screen.blit(hint, (result_rect.x + 12, result_rect.y + 32))
 
         # 特效
-        if me.get("lines", 0) > prev_lines[me_role]:
+        me_lines, peer_lines = lines[me_role], lines[peer_role]
+        if me_lines > prev_lines[me_role]:
             flash_self.trigger()
             confetti.burst((left_x + board_w_px//2, top_y + board_h_px//2), n=30)
-            prev_lines[me_role] = me["lines"]
-        if peer.get("lines", 0) > prev_lines[peer_role]:
+            prev_lines[me_role] = me_lines
+        if peer_lines > prev_lines[peer_role]:
             flash_rival.trigger()
-            prev_lines[peer_role] = peer["lines"]
+            prev_lines[peer_role] = peer_lines
 
-        flash_self.draw(screen, pygame.Rect(left_x, top_y, board_w_px, board_h_px))
-        flash_rival.draw(screen, pygame.Rect(right_x, top_y, board_w_px, board_h_px))
-        confetti.update_draw(screen, clock.get_time()/1000.0)
+        dt = clock.get_time()/1000.0
+        flash_self.draw(screen, pygame.Rect(left_x, top_y, board_w_px, board_h_px), dt)
+        flash_rival.draw(screen, pygame.Rect(right_x, top_y, board_w_px, board_h_px), dt)
+        confetti.update_draw(screen, dt)
 
         pygame.display.flip()
         clock.tick(FPS)
@@ -1,32 +1,56 @@
 """Shared constants/helpers for Tetris Battle."""
-from itertools import groupby
 
 BOARD_W, BOARD_H = 10, 20
 
 
 def rle_encode_rowmajor(grid):
-    flat = []
-    for y in range(len(grid)):
-        for x in range(len(grid[0])):
-            flat.append(grid[y][x])
     out = []
-    for val, group in groupby(flat):
-        cnt = sum(1 for _ in group)
-        out.append(f"{val}:{cnt}")
+    prev, cnt = None, 0
+    blank = [0] * len(grid[0]) if grid else []
+    for row in grid:
+        # Empty rows (most of the board) just extend the running zero run.
+        if prev == 0 and row == blank:
+            cnt += len(row)
+            continue
+        for v in row:
+            if v == prev:
+                cnt += 1
+            else:
+                if cnt:
+                    out.append(f"{prev}:{cnt}")
+                prev, cnt = v, 1
+    if cnt:
+        out.append(f"{prev}:{cnt}")
     return ",".join(out)
 
 
 def rle_decode_rowmajor(s, w, h):
-    nums = []
-    if s:
-        for part in s.split(","):
-            v, c = part.split(":")
-            nums.extend([int(v)] * int(c))
-    if len(nums) != w * h:
-        nums = [0] * (w * h)
     grid = [[0]*w for _ in range(h)]
-    it = iter(nums)
-    for y in range(h):
-        for x in range(w):
-            grid[y][x] = next(it)
+    rle_decode_into(s, grid)
     return grid
+
+
+def rle_decode_into(s, grid):
+    """Decode into an existing h×w list-of-lists in place; malformed input leaves it all zero."""
+    h = len(grid)
+    w = len(grid[0]) if h else 0
+    # "v:c,v:c,..." -> one flat int list in a single split/map pass.
+    nums = list(map(int, s.replace(":", ",").split(","))) if s else []
+    vals, counts = nums[0::2], nums[1::2]
+    zeros = [0] * w
+    for row in grid:
+        row[:] = zeros
+    if len(vals) != len(counts) or sum(counts) != w * h or min(counts, default=1) <= 0:
+        return False
+    # Boards are mostly empty: skip zero runs, slice-assign the rest row by row.
+    pos = 0
+    for v, c in zip(vals, counts):
+        end = pos + c
+        if v:
+            while pos < end:
+                y, x = divmod(pos, w)
+                n = min(w - x, end - pos)
+                grid[y][x:x + n] = [v] * n
+                pos += n
+        pos = end
+    return True
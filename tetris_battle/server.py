@@ -3,41 +3,91 @@
 
 啟動參數由 Lobby 傳入：
   --host 0.0.0.0 --port <port> --room <room_id> --players user1,user2
+
+收輸入、tick 與廣播都在 serve_game 的單一 selector 迴圈內執行，
+Game / Player 狀態只有這個執行緒會讀寫，因此不加鎖。
 """
 import argparse
 import json
 import random
+import selectors
 import socket
-import threading
 import time
+from collections import deque
+from itertools import islice
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 from proto import BOARD_W, BOARD_H, rle_encode_rowmajor
 
 # 網路 framing：4 bytes 長度 + JSON
+# 有 orjson 時直接產生 UTF-8 bytes；否則沿用同一個緊湊 encoder，不必每次重建
+if orjson is not None:
+    _dumps = orjson.dumps
+    _loads = orjson.loads
+else:
+    _encode = json.JSONEncoder(separators=(",", ":")).encode
+
+    def _dumps(obj) -> bytes:
+        return _encode(obj).encode("utf-8")
+
+    def _loads(data: bytes):
+        return json.loads(data.decode("utf-8"))
+
+
 def send_json(sock: socket.socket, obj: dict):
-    data = json.dumps(obj).encode("utf-8")
+    data = _dumps(obj)
     hdr = len(data).to_bytes(4, "big")
     sock.sendall(hdr + data)
 
 
-def recv_json(sock: socket.socket):
-    hdr = sock.recv(4)
-    if not hdr:
-        return None
-    n = int.from_bytes(hdr, "big")
-    body = b""
-    while len(body) < n:
-        chunk = sock.recv(n - len(body))
-        if not chunk:
-            return None
-        body += chunk
-    try:
-        return json.loads(body.decode("utf-8"))
-    except Exception:
-        return None
+def pack_frames(bodies) -> bytes:
+    """已編碼好的多個 JSON body 串成一段 bytes，一次 sendall 送出。"""
+    bufs = []
+    for data in bodies:
+        bufs.append(len(data).to_bytes(4, "big"))
+        bufs.append(data)
+    return b"".join(bufs)
+
+
+MAX_FRAME = 65536
+
+
+class FrameBuffer:
+    """select 通知可讀時收多少算多少，湊滿完整 frame 才解析，不會卡在半個 frame 上。"""
+
+    def __init__(self):
+        self.buf = bytearray()
+
+    def feed(self, data: bytes):
+        """回傳這次湊齊的訊息（只收 JSON 物件）；遇到過大或無法解析的 frame 回傳 None。"""
+        buf = self.buf
+        buf += data
+        msgs = []
+        pos = 0
+        while len(buf) - pos >= 4:
+            n = int.from_bytes(buf[pos:pos+4], "big")
+            if n > MAX_FRAME:
+                return None
+            end = pos + 4 + n
+            if len(buf) < end:
+                break
+            try:
+                obj = _loads(buf[pos+4:end])
+            except Exception:
+                return None
+            # 合法 JSON 但不是物件（例如 [1,2]）就丟掉，呼叫端只處理 dict
+            if isinstance(obj, dict):
+                msgs.append(obj)
+            pos = end
+        del buf[:pos]
+        return msgs
 
 
 TICK_MS = 500
+GAME_SECONDS = 15
 SHAPES = ["I", "O", "T", "S", "Z", "J", "L"]
 SHAPE_MASKS = {
     "I": [[0,0,0,0],[1,1,1,1],[0,0,0,0],[0,0,0,0]],
@@ -55,42 +105,106 @@ def rotate_cw(mask):
     return [[mask[3-x][y] for x in range(4)] for y in range(4)]
 
 
-def shape_mask(shape, rot):
-    m = SHAPE_MASKS[shape]
-    for _ in range(rot % 4):
-        m = rotate_cw(m)
-    return m
+def _rotations(mask):
+    rots = []
+    for _ in range(4):
+        rots.append(tuple(tuple(r) for r in mask))
+        mask = rotate_cw(mask)
+    return rots
 
 
-def fits(board, shape, x, y, rot):
-    m = shape_mask(shape, rot)
-    for yy in range(4):
-        for xx in range(4):
-            if not m[yy][xx]:
-                continue
-            bx = x + xx
-            by = y + yy
-            if bx < 0 or bx >= BOARD_W or by < 0 or by >= BOARD_H:
-                return False
-            if board[by][bx] != 0:
-                return False
-    return True
+# 28 個 (shape, rot) 遮罩在 import 時轉好，之後只查表
+SHAPE_ROT = {(shape, rot): m for shape in SHAPES for rot, m in enumerate(_rotations(SHAPE_MASKS[shape]))}
+
+
+# 碰撞與消行用 bitboard：每列一個 BOARD_W-bit 整數（bit x = 第 x 欄有方塊）
+# 顏色另存在 board（RLE 快照要送顏色），兩者在 lock/clear 時同步更新
+FULL_ROW = (1 << BOARD_W) - 1
+
+
+def _row_bits(m):
+    return tuple(sum(1 << xx for xx in range(4) if m[yy][xx]) for yy in range(4))
+
+
+def _cells(m):
+    return tuple((yy, xx) for yy in range(4) for xx in range(4) if m[yy][xx])
 
 
-def lock_piece(board, shape, x, y, rot, color_id):
-    m = shape_mask(shape, rot)
-    for yy in range(4):
-        for xx in range(4):
-            if m[yy][xx]:
-                board[y+yy][x+xx] = color_id
+PIECE_TABLE = {key: _row_bits(m) for key, m in SHAPE_ROT.items()}
+PIECE_CELLS = {key: _cells(m) for key, m in SHAPE_ROT.items()}
 
 
-def clear_full_lines(board):
-    new_rows = [row for row in board if any(v == 0 for v in row)]
-    cleared = BOARD_H - len(new_rows)
-    while len(new_rows) < BOARD_H:
-        new_rows.insert(0, [0]*BOARD_W)
-    return cleared, new_rows
+def _placed(bits_rows, x):
+    """(yy, 已平移到第 x 欄的 row bits)；有格子超出左右邊界時回傳 None。"""
+    out = []
+    for yy, bits in enumerate(bits_rows):
+        if not bits:
+            continue
+        if x < 0:
+            if bits & ((1 << -x) - 1):
+                return None
+            bits >>= -x
+        else:
+            bits <<= x
+        if bits >> BOARD_W:
+            return None
+        out.append((yy, bits))
+    return tuple(out)
+
+
+# PLACED[shape][rot][x + 3] -> 預先平移好的列遮罩（超出左右邊界為 None）；
+# 用巢狀 tuple 索引取代 (shape, rot, x) 組 key 再雜湊，碰撞測試只剩索引與 AND
+X_MIN = -3
+PLACED = {shape: tuple(tuple(_placed(PIECE_TABLE[(shape, rot)], x) for x in range(X_MIN, BOARD_W))
+                       for rot in range(4))
+          for shape in SHAPES}
+
+
+def fits(rows, shape, x, y, rot, h=BOARD_H, w=BOARD_W):
+    if x < X_MIN or x >= w:
+        return False
+    placed = PLACED[shape][rot & 3][x - X_MIN]
+    if placed is None:
+        return False
+    for yy, bits in placed:
+        by = y + yy
+        if by < 0 or by >= h or bits & rows[by]:
+            return False
+    return True
+
+
+def drop_distance(rows, shape, x, y, rot, h=BOARD_H, w=BOARD_W):
+    """目前位置還能往下掉幾格（hard drop 一次算完，不逐格改 active）。"""
+    if x < X_MIN or x >= w:
+        return 0
+    placed = PLACED[shape][rot & 3][x - X_MIN]
+    if placed is None:
+        return 0
+    d = 0
+    while True:
+        for yy, bits in placed:
+            by = y + yy + d + 1
+            if by < 0 or by >= h or bits & rows[by]:
+                return d
+        d += 1
+
+
+def lock_piece(board, rows, shape, x, y, rot, color_id):
+    for yy, bits in PLACED[shape][rot & 3][x - X_MIN]:
+        rows[y+yy] |= bits
+    for yy, xx in PIECE_CELLS[(shape, rot & 3)]:
+        board[y+yy][x+xx] = color_id
+
+
+def clear_full_lines(board, rows):
+    # 大多數 lock 不會消行：先用 C 層級的 in 掃一次，沒有滿列就原樣返回
+    if FULL_ROW not in rows:
+        return 0, board, rows
+    keep = [i for i, r in enumerate(rows) if r != FULL_ROW]
+    cleared = BOARD_H - len(keep)
+    new_rows = [0]*cleared + [rows[i] for i in keep]
+    new_board = [[0]*BOARD_W for _ in range(cleared)] + [board[i] for i in keep]
+    return cleared, new_board, new_rows
 
 
 class SevenBag:
@@ -112,27 +226,35 @@ def new_board():
     return [[0]*BOARD_W for _ in range(BOARD_H)]
 
 
+def new_rows():
+    return [0]*BOARD_H
+
+
 class Player:
     def __init__(self, sock, role):
         self.s = sock
         self.role = role
         self.board = new_board()
+        self.rows = new_rows()
+        self.rle = None   # boardRLE 快取，只有 lock 時盤面才會變
+        # SNAPSHOT 的固定欄位只編碼一次，之後每 tick 只接上會變的部分
+        self.snap_head = _dumps({"type": "SNAPSHOT", "role": role, "userId": role, "level": 1})[:-1] + b","
         self.score = 0
         self.lines = 0
         self.active = None
         self.alive = True
         self.hold = None
         self.can_hold = True
-        self.next = []
+        self.next = deque()
 
     def spawn_from_queue(self, bag: SevenBag):
         while len(self.next) < 5:
             self.next.append(bag.next())
-        shape = self.next.pop(0)
+        shape = self.next.popleft()
         color_id = SHAPE_COLOR[shape]
         self.active = {"shape": shape, "x": 3, "y": 0, "rot": 0, "color": color_id}
         self.can_hold = True
-        if not fits(self.board, shape, self.active["x"], self.active["y"], self.active["rot"]):
+        if not fits(self.rows, shape, self.active["x"], self.active["y"], self.active["rot"]):
             self.alive = False
 
 
@@ -140,11 +262,12 @@ class Game:
     def __init__(self, seed):
         self.seed = seed
         self.players = {}
-        self.lock = threading.RLock()
         self.tick = 0
         self.running = True
         self.bag = SevenBag(seed)
-        self.start_ts = int(time.time())
+        # 每個 tick 只取一次時鐘，step 與快照共用
+        self.start_ns = time.time_ns()
+        self.now_ms = self.start_ns // 1_000_000
 
     def add_player(self, role, sock):
         self.players[role] = Player(sock, role)
@@ -162,7 +285,7 @@ class Game:
             return False
         a = p.active
         nx, ny, nr = a["x"] + dx, a["y"] + dy, (a["rot"] + drot) % 4
-        if fits(p.board, a["shape"], nx, ny, nr):
+        if fits(p.rows, a["shape"], nx, ny, nr):
             a["x"], a["y"], a["rot"] = nx, ny, nr
             return True
         return False
@@ -170,88 +293,92 @@ class Game:
     def _hard_drop(self, p: Player):
         if not p.active:
             return
-        while self._try_move(p, dy=1):
-            pass
+        a = p.active
+        a["y"] += drop_distance(p.rows, a["shape"], a["x"], a["y"], a["rot"])
         self._lock_and_refill(p, hard_drop=True)
 
     def _soft_drop_or_gravity(self, p: Player):
-        if not self._try_move(p, dy=1):
+        # 重力只動 y，直接測下一格，不經過 _try_move 的 dx/drot 計算
+        a = p.active
+        if a and fits(p.rows, a["shape"], a["x"], a["y"] + 1, a["rot"]):
+            a["y"] += 1
+        else:
             self._lock_and_refill(p, hard_drop=False)
 
     def _lock_and_refill(self, p: Player, hard_drop=False):
         a = p.active
         if not a:
             return
-        lock_piece(p.board, a["shape"], a["x"], a["y"], a["rot"], a["color"])
+        lock_piece(p.board, p.rows, a["shape"], a["x"], a["y"], a["rot"], a["color"])
+        p.rle = None
         p.score += (2 if hard_drop else 1)
-        cleared, new_b = clear_full_lines(p.board)
+        cleared, new_b, new_r = clear_full_lines(p.board, p.rows)
         if cleared > 0:
-            p.board = new_b
+            p.board, p.rows = new_b, new_r
             p.lines += cleared
             p.score += 100 * cleared
         p.spawn_from_queue(self.bag)
 
     def handle_input(self, role, msg):
-        with self.lock:
-            p = self.players.get(role)
-            if not p or not p.alive:
-                return
-            act = msg.get("action")
-            if act == "LEFT":
-                self._try_move(p, dx=-1)
-            elif act == "RIGHT":
-                self._try_move(p, dx=1)
-            elif act == "SOFT":
-                self._soft_drop_or_gravity(p)
-            elif act == "HARD":
-                self._hard_drop(p)
-            elif act == "ROT":
-                self._try_move(p, drot=1)
-            elif act == "HOLD":
-                if p.can_hold and p.active:
-                    cur = p.active["shape"]
-                    if p.hold is None:
-                        p.hold = cur
-                        p.spawn_from_queue(self.bag)
-                    else:
-                        p.hold, p.active["shape"] = cur, p.hold
-                        p.active.update({"x":3,"y":0,"rot":0,
-                                         "color":SHAPE_COLOR[p.active["shape"]]})
-                        if not fits(p.board, p.active["shape"], p.active["x"], p.active["y"], p.active["rot"]):
-                            p.alive = False
-                    p.can_hold = False
+        p = self.players.get(role)
+        if not p or not p.alive:
+            return
+        act = msg.get("action")
+        if act == "LEFT":
+            self._try_move(p, dx=-1)
+        elif act == "RIGHT":
+            self._try_move(p, dx=1)
+        elif act == "SOFT":
+            self._soft_drop_or_gravity(p)
+        elif act == "HARD":
+            self._hard_drop(p)
+        elif act == "ROT":
+            self._try_move(p, drot=1)
+        elif act == "HOLD":
+            if p.can_hold and p.active:
+                cur = p.active["shape"]
+                if p.hold is None:
+                    p.hold = cur
+                    p.spawn_from_queue(self.bag)
+                else:
+                    p.hold, p.active["shape"] = cur, p.hold
+                    p.active.update({"x":3,"y":0,"rot":0,
+                                     "color":SHAPE_COLOR[p.active["shape"]]})
+                    if not fits(p.rows, p.active["shape"], p.active["x"], p.active["y"], p.active["rot"]):
+                        p.alive = False
+                p.can_hold = False
 
     def step(self):
-        with self.lock:
-            self.tick += 1
-            for p in self.players.values():
-                if p.alive:
-                    self._soft_drop_or_gravity(p)
-            # 縮短對局時間，預設 15 秒結束
-            if int(time.time()) - self.start_ts >= 15:
-                self.running = False
-            if self.players and all(not pl.alive for pl in self.players.values()):
-                self.running = False
-
-    def snapshots(self):
-        with self.lock:
-            snaps = []
-            for role, p in self.players.items():
-                snaps.append({
-                    "type": "SNAPSHOT",
-                    "tick": self.tick,
-                    "role": role,
-                    "userId": role,
-                    "boardRLE": rle_encode_rowmajor(p.board),
-                    "active": {"shape": p.active["shape"], "x": p.active["x"], "y": p.active["y"], "rot": p.active["rot"]} if p.active else None,
-                    "hold": p.hold,
-                    "next": list(p.next[:3]),
-                    "score": p.score,
-                    "lines": p.lines,
-                    "level": 1,
-                    "at": int(time.time() * 1000)
-                })
-            return snaps
+        now = time.time_ns()
+        self.now_ms = now // 1_000_000
+        self.tick += 1
+        for p in self.players.values():
+            if p.alive:
+                self._soft_drop_or_gravity(p)
+        # 縮短對局時間，預設 15 秒結束
+        if now - self.start_ns >= GAME_SECONDS * 1_000_000_000:
+            self.running = False
+        if self.players and all(not pl.alive for pl in self.players.values()):
+            self.running = False
+
+    def _snap_fields(self, p: Player):
+        if p.rle is None:
+            p.rle = rle_encode_rowmajor(p.board)
+        a = p.active
+        return {
+            "tick": self.tick,
+            "boardRLE": p.rle,
+            "active": {"shape": a["shape"], "x": a["x"], "y": a["y"], "rot": a["rot"]} if a else None,
+            "hold": p.hold,
+            "next": list(islice(p.next, 3)),
+            "score": p.score,
+            "lines": p.lines,
+            "at": self.now_ms
+        }
+
+    def snapshot_bodies(self):
+        """每位玩家的 SNAPSHOT JSON bytes：固定前綴 snap_head + 可變欄位（去掉開頭的 '{'）。"""
+        return [p.snap_head + _dumps(self._snap_fields(p))[1:] for p in self.players.values()]
 
 
 def serve_game(host, port, room, users_csv=""):
@@ -267,6 +394,8 @@ def serve_game(host, port, room, users_csv=""):
             while True:
                 c, _ = srv.accept()
                 try:
+                    # 快照每 tick 一小包，關掉 Nagle 避免等 ACK 才送
+                    c.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
                     send_json(c, {"type": "HELLO", "version": 1, "roomId": room})
                     g.add_player(role, c)
                     return c
@@ -278,41 +407,54 @@ def serve_game(host, port, room, users_csv=""):
         c1 = accept_player("P1")
         c2 = accept_player("P2")
 
-        def rx(role, sock):
-            try:
-                while g.running:
-                    msg = recv_json(sock)
-                    if not msg:
-                        break
-                    if msg.get("type") == "INPUT":
-                        g.handle_input(role, msg)
-            finally:
-                try: sock.close()
-                except: pass
-
-        threading.Thread(target=rx, args=("P1", c1), daemon=True).start()
-        threading.Thread(target=rx, args=("P2", c2), daemon=True).start()
-
-        next_tick = time.time()
+        # 單執行緒事件迴圈：select 等到輸入或下一個 tick，兩者都不用 busy-sleep；
+        # 遊戲狀態只有這個執行緒會動，不需要鎖
+        sel = selectors.DefaultSelector()
+        sel.register(c1, selectors.EVENT_READ, ("P1", FrameBuffer()))
+        sel.register(c2, selectors.EVENT_READ, ("P2", FrameBuffer()))
+
+        next_tick = time.monotonic()
         while g.running:
-            now = time.time()
-            if now >= next_tick:
-                g.step()
-                snaps = g.snapshots()
-                for p in list(g.players.values()):
-                    for s in snaps:
-                        try: send_json(p.s, s)
-                        except OSError:
-                            pass
-                next_tick += TICK_MS / 1000.0
-            time.sleep(0.005)
+            timeout = next_tick - time.monotonic()
+            if timeout > 0:
+                for key, _ in sel.select(timeout):
+                    role, fb = key.data
+                    try:
+                        data = key.fileobj.recv(65536)
+                    except OSError:
+                        data = b""
+                    msgs = fb.feed(data) if data else None
+                    if msgs is None:
+                        sel.unregister(key.fileobj)
+                        try: key.fileobj.close()
+                        except: pass
+                        continue
+                    for msg in msgs:
+                        if msg.get("type") == "INPUT":
+                            try:
+                                g.handle_input(role, msg)
+                            except Exception as e:
+                                # 兩位玩家共用這個迴圈，單一玩家的怪輸入只丟掉那一則
+                                print(f"[GAME] bad input from {role}: {e!r}", flush=True)
+                continue
+            g.step()
+            # 快照只序列化一次，每位玩家一個 sendall
+            frames = pack_frames(g.snapshot_bodies())
+            for p in list(g.players.values()):
+                try: p.s.sendall(frames)
+                except OSError:
+                    pass
+            next_tick += TICK_MS / 1000.0
+        sel.close()
 
         # 結算
         p1, p2 = g.players["P1"], g.players["P2"]
         winner = "draw" if p1.score == p2.score else ("P1" if p1.score > p2.score else "P2")
         result = {"type": "RESULT", "winner": winner, "p1": p1.score, "p2": p2.score}
+        # 與快照相同：結果只編碼一次，兩位玩家共用同一段 frame
+        frame = pack_frames([_dumps(result)])
         for p in g.players.values():
-            try: send_json(p.s, result)
+            try: p.s.sendall(frame)
             except OSError:
                 pass
 
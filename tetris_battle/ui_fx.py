@@ -1,13 +1,25 @@
 """Small pygame UI helpers for Tetris Battle."""
-import random, math, pygame
+import functools, random, math, pygame
+
+
+@functools.lru_cache(maxsize=32)
+def sysfont(name, size):
+    """SysFont 每次都要查系統字型再建 Font；同樣的 (name, size) 只建一次。"""
+    return pygame.font.SysFont(name, size)
+
+
+@functools.lru_cache(maxsize=128)
+def render_text(font, text, color):
+    """很少變動的文字（標題、分數、提示）快取成 Surface，每幀直接 blit。"""
+    return font.render(text, True, color)
 
 
 def draw_header(surface, text, sub="", font=None, sub_font=None, pos=(20, 20)):
-    font = font or pygame.font.SysFont(None, 32)
-    sub_font = sub_font or pygame.font.SysFont(None, 22)
-    surface.blit(font.render(text, True, (230, 230, 230)), pos)
+    font = font or sysfont(None, 32)
+    sub_font = sub_font or sysfont(None, 22)
+    surface.blit(render_text(font, text, (230, 230, 230)), pos)
     if sub:
-        surface.blit(sub_font.render(sub, True, (190, 190, 190)), (pos[0], pos[1] + 30))
+        surface.blit(render_text(sub_font, sub, (190, 190, 190)), (pos[0], pos[1] + 30))
 
 
 def draw_block_cell(surface, x, y, size, color):
@@ -21,18 +33,24 @@ class FlashOverlay:
         self.color = color
         self.duration = duration
         self.t = 0.0
+        # (w, h) -> 填好顏色的 Surface；淡出只改 surface alpha，不必每幀重建
+        self._cache: dict[tuple[int, int], pygame.Surface] = {}
 
     def trigger(self):
         self.t = self.duration
 
-    def draw(self, surface, rect):
+    def draw(self, surface, rect, dt=0.016):
         if self.t <= 0:
             return
         alpha = int(180 * (self.t / self.duration))
-        overlay = pygame.Surface((rect.width, rect.height), pygame.SRCALPHA)
-        overlay.fill((*self.color, alpha))
+        key = (rect.width, rect.height)
+        overlay = self._cache.get(key)
+        if overlay is None:
+            overlay = self._cache[key] = pygame.Surface(key)
+            overlay.fill(self.color)
+        overlay.set_alpha(alpha)
         surface.blit(overlay, rect)
-        self.t -= 0.016
+        self.t -= dt
 
 
 class ScreenShake:
@@ -46,34 +64,52 @@ class ScreenShake:
         if self.strength <= 0:
             return 0, 0
         self.strength *= 0.9
-        return (random.randint(-self.strength, self.strength),
-                random.randint(-self.strength, self.strength))
+        # randint 不接受小數；衰減到不足 1 像素就停
+        s = int(self.strength)
+        if s <= 0:
+            self.strength = 0
+            return 0, 0
+        # 一次取亂數再拆成 x、y 兩個位移
+        span = 2 * s + 1
+        dx, dy = divmod(random.randrange(span * span), span)
+        return dx - s, dy - s
+
+
+CONFETTI_COLORS = [(0,255,180),(255,200,0),(255,80,120),(80,160,255)]
 
 
 class Confetti:
+    """粒子是等速直線運動，位置可由時間直接算出。
+
+    每顆存成 tuple (ax, ay, vx, vy, 消失時間, 顏色)，其中 x = ax + vx * t；
+    每幀不必逐顆更新 dict，只在有粒子到期時過濾一次。
+    """
+
     def __init__(self):
+        self.t = 0.0
         self.particles = []
 
     def burst(self, pos, n=20):
-        for _ in range(n):
-            ang = random.random() * math.tau
-            speed = random.uniform(80, 160)
-            self.particles.append({
-                "x": pos[0], "y": pos[1],
-                "vx": math.cos(ang) * speed,
-                "vy": math.sin(ang) * speed,
-                "life": random.uniform(0.5, 1.2),
-                "c": random.choice([(0,255,180),(255,200,0),(255,80,120),(80,160,255)])
-            })
+        t = self.t
+        rand = random.random
+        # 顏色一次抽完；速度、壽命直接由 random() 縮放，省掉 uniform() 的 Python 層呼叫
+        for c in random.choices(CONFETTI_COLORS, k=n):
+            ang = rand() * math.tau
+            speed = 80 + 80 * rand()
+            vx, vy = math.cos(ang) * speed, math.sin(ang) * speed
+            self.particles.append((pos[0] - vx * t, pos[1] - vy * t, vx, vy,
+                                   t + 0.5 + 0.7 * rand(), c))
 
     def update_draw(self, surface, dt):
-        alive = []
-        for p in self.particles:
-            p["life"] -= dt
-            if p["life"] <= 0:
-                continue
-            p["x"] += p["vx"] * dt
-            p["y"] += p["vy"] * dt
-            pygame.draw.circle(surface, p["c"], (int(p["x"]), int(p["y"])), 3)
-            alive.append(p)
-        self.particles = alive
+        if not self.particles:
+            return
+        self.t = t = self.t + dt
+        particles = self.particles
+        if any(p[4] <= t for p in particles):
+            particles = self.particles = [p for p in particles if p[4] > t]
+            if not particles:
+                self.t = 0.0  # 全部消失就把時鐘歸零，數值不會一直長大
+                return
+        circle = pygame.draw.circle
+        for ax, ay, vx, vy, _, c in particles:
+            circle(surface, c, (int(ax + vx * t), int(ay + vy * t)), 3)